@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Latency of dice rolls and number of random.org calls for a mixed workload,
+against the local random.org stand-in with different failure modes.
+Fallback bits are bits that came from random.py instead of random.org.
+
+Usage: python3 benchmarks/dice.py [--rolls 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cogs.dice import RandomAPI
+from random_org import RandomOrg, start
+
+# (max, min, num, weight) like the arguments to !roll
+WORKLOAD = [
+    (6, 1, 1, 50),
+    (20, 1, 1, 20),
+    (1000, 1, 1, 10),
+    (100, 1, 1, 10),
+    (6, 1, 4, 5),
+    (12345, 10, 3, 4),
+    (1000000, 1, 100, 1),
+]
+
+SCENARIOS = {
+    'fast': dict(latency=0.01),
+    'slow': dict(latency=0.5, jitter=0.2),
+    'flaky': dict(latency=0.05, error_rate=0.3),
+    'no quota': dict(latency=0.05, quota=0),
+}
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(name: str, options: dict, rolls: int) -> None:
+    server = RandomOrg(**options)
+    runner, url = await start(server)
+    api = RandomAPI('benchmark', url)
+    api.start()
+    await asyncio.sleep(0.1)
+
+    # Users don't roll back to back, leave a little time between rolls
+    weights = [w[3] for w in WORKLOAD]
+    latency = []
+    for _ in range(rolls):
+        j, i, n, _ = random.choices(WORKLOAD, weights)[0]
+        begin = time.perf_counter()
+        await api.roll(i, j, n)
+        latency.append(time.perf_counter() - begin)
+        await asyncio.sleep(0.001)
+
+    if api.filling is not None:
+        await api.filling
+    fallback = api.pool.added - server.integers * api.width
+    print(f'{name:>10} {percentile(latency, 0.5) * 1000:>9.2f} {percentile(latency, 0.99) * 1000:>9.2f}'
+          f' {server.calls:>7} {fallback:>14}')
+    await api.close()
+    await runner.cleanup()
+
+
+async def main(rolls: int) -> None:
+    random.seed(0)
+    print(f"{'scenario':>10} {'p50 (ms)':>9} {'p99 (ms)':>9} {'calls':>7} {'fallback bits':>14}")
+    for name, options in SCENARIOS.items():
+        await run(name, options, rolls)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rolls', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(main(args.rolls))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Stand-in for a sharded senko.py process, for running supervisor.py without
+connecting to Discord. Works out its shards from config.yaml and the
+environment with the same code as senko.py, fakes a gateway connection per
+shard with jittery heartbeat latency and a number of guilds, and serves
+metrics through the real Metrics cog. Can be told to crash to see restarts.
+
+Usage: python3 supervisor.py benchmarks/fake_shard.py [--guilds 100]
+       [--latency 0.05] [--crash-after 30]
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cogs.metrics import Metrics
+from cogs.utils import shards
+
+
+class FakeGuild:
+    def __init__(self, id: int, shard_id: int) -> None:
+        self.id = id
+        self.shard_id = shard_id
+
+
+class FakeShardedBot:
+    """
+    The parts of AutoShardedBot the Metrics cog reads, with a heartbeat per
+    shard instead of a gateway connection.
+    """
+
+    def __init__(self, sharding: dict, guilds: int, latency: float) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.db = sharding['db']
+        self.metrics = sharding['metrics']
+        self.shard_count = sharding['count']
+        self.shard_ids = sharding['ids'] or list(range(self.shard_count or 1))
+        self.latency = latency
+        self._latencies = {s: latency for s in self.shard_ids}
+        self.guilds = [FakeGuild(s * guilds + i, s) for s in self.shard_ids for i in range(guilds)]
+
+    @property
+    def latencies(self) -> list:
+        return list(self._latencies.items())
+
+    async def heartbeat(self, interval: float=1) -> None:
+        while True:
+            for shard in self.shard_ids:
+                self._latencies[shard] = self.latency * random.uniform(0.5, 1.5)
+            await asyncio.sleep(interval)
+
+    def before_invoke(self, coro) -> None:
+        pass
+
+    def after_invoke(self, coro) -> None:
+        pass
+
+    def get_cog(self, name: str):
+        return None
+
+
+async def run(args: argparse.Namespace) -> int:
+    with open('config.yaml') as stream:
+        config = yaml.safe_load(stream)
+    try:
+        sharding = shards.settings(config)
+    except ValueError as err:
+        print(err, flush=True)
+        return 1
+    bot = FakeShardedBot(sharding, args.guilds, args.latency)
+    metrics = Metrics(bot)
+    print(f'Fake shards {bot.shard_ids} of {bot.shard_count} connected', flush=True)
+
+    # Exit cleanly on SIGTERM like the bot does, or crash if asked to
+    heartbeat = asyncio.ensure_future(bot.heartbeat())
+    stopped = asyncio.Event()
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    try:
+        await asyncio.wait_for(stopped.wait(), args.crash_after)
+        code = 0
+    except asyncio.TimeoutError:
+        print(f'Fake shards {bot.shard_ids} crashing', flush=True)
+        code = 1
+    heartbeat.cancel()
+    for task in metrics.tasks:
+        task.cancel()
+    if metrics.runner is not None:
+        await metrics.runner.cleanup()
+    return code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--guilds', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--crash-after', type=float, default=None)
+    args = parser.parse_args()
+    sys.exit(asyncio.get_event_loop().run_until_complete(run(args)))
+
+
+if __name__ == '__main__':
+    main()
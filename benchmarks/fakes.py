@@ -0,0 +1,190 @@
+"""
+Lightweight stand-ins for the discord.py objects the cogs touch, an
+in-memory replacement for the database pool, and generators for guilds,
+subscribers and message streams.
+"""
+import asyncio
+import random
+
+from cogs.utils import triggers
+from cogs.utils.router import Router
+
+
+class FakeSent:
+    async def edit(self, **kwargs) -> None:
+        pass
+
+
+class FakeUser:
+    def __init__(self, id: int, bot: bool=False) -> None:
+        self.id = id
+        self.name = f'user{id}'
+        self.display_name = self.name
+        self.discriminator = '0000'
+        self.bot = bot
+        self.sent = 0
+
+    async def send(self, *args, **kwargs) -> FakeSent:
+        self.sent += 1
+        return FakeSent()
+
+
+class FakeMember(FakeUser):
+    def __init__(self, id: int, guild: 'FakeGuild', bot: bool=False) -> None:
+        super().__init__(id, bot)
+        self.guild = guild
+        self.roles = []
+
+
+class FakePermissions:
+    read_messages = True
+
+
+class FakeChannel:
+    def __init__(self, id: int, guild: 'FakeGuild') -> None:
+        self.id = id
+        self.name = f'channel{id}'
+        self.guild = guild
+        self.sent = 0
+
+    @property
+    def members(self) -> list:
+        # Like discord.py, check permissions for every member of the guild
+        return [m for m in self.guild.members if self.permissions_for(m).read_messages]
+
+    def permissions_for(self, member: FakeMember) -> FakePermissions:
+        return FakePermissions()
+
+    async def send(self, *args, **kwargs) -> FakeSent:
+        self.sent += 1
+        return FakeSent()
+
+
+class FakeGuild:
+    def __init__(self, id: int, members: int, channels: int=5) -> None:
+        self.id = id
+        self.name = f'guild{id}'
+        self.members = [FakeMember(id * 1000000 + i, self) for i in range(members)]
+        self.text_channels = [FakeChannel(id * 1000 + i, self) for i in range(channels)]
+        self._members = {m.id: m for m in self.members}
+
+    def get_member(self, user_id: int) -> FakeMember:
+        return self._members.get(user_id)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeEmbed:
+    Empty = None
+
+    def __init__(self, title: str=None, description: str=None, fields: list=()) -> None:
+        self.title = title
+        self.description = description
+        self.fields = list(fields)
+
+
+class FakeField:
+    def __init__(self, name: str, value: str) -> None:
+        self.name = name
+        self.value = value
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeMember, channel: FakeChannel, embeds: list=(), webhook_id: int=None) -> None:
+        self.id = random.getrandbits(63)
+        self.content = content
+        self.clean_content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.embeds = list(embeds)
+        self.webhook_id = webhook_id
+        self.jump_url = f'https://discord.com/channels/{self.guild.id}/{channel.id}/{self.id}'
+
+
+class FakeBot:
+    def __init__(self, users: list) -> None:
+        self.loop = asyncio.get_event_loop()
+        self.user = FakeUser(1, bot=True)
+        self.owner = 0
+        self.keys = {'random': ''}
+        self.db = {'socket': '', 'user': '', 'password': '', 'database': ''}
+        self.quiet = {'guilds': frozenset(), 'channels': frozenset()}
+        self.dt = frozenset()
+        self.notify = {}
+        self.random_url = None
+        self._users = {u.id: u for u in users}
+        self.router = Router(self)
+        self.triggers = triggers.load()
+
+    def get_user(self, user_id: int) -> FakeUser:
+        return self._users.get(user_id)
+
+
+class MemoryPool:
+    """Answers the keyword queries from a list of (guild, user, word) rows."""
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self.calls = 0
+
+    async def fetchall(self, query: str, args: tuple=()) -> list:
+        self.calls += 1
+        if query.startswith('CALL get_words'):
+            return [{'user': u, 'word': w} for g, u, w in self.rows if g == args[0]]
+        if query.startswith('SELECT `word`'):
+            return [{'word': w} for g, u, w in self.rows if u == args[0]]
+        if query.startswith('SELECT DISTINCT `user`'):
+            return [{'user': u} for u in set(u for g, u, w in self.rows)]
+        return []
+
+    async def fetchone(self, query: str, args: tuple=()) -> dict:
+        self.calls += 1
+        return {'exists': int(any(u == args[0] for g, u, w in self.rows))}
+
+    async def execute(self, query: str, args: tuple=()) -> int:
+        self.calls += 1
+        return 0
+
+    async def executemany(self, query: str, rows: list) -> int:
+        self.calls += 1
+        return 0
+
+    async def run(self, func, *args):
+        self.calls += 1
+
+    def close(self) -> None:
+        pass
+
+
+FILLER = ('the quick brown fox jumps over lazy dog and then some more words '
+          'about nothing much at all really just chatting away').split()
+
+
+def make_guild(guild_id: int, members: int, subscribers: int, keywords: int, vocabulary: list) -> tuple:
+    # Make a guild and the keyword rows for its subscribers
+    guild = FakeGuild(guild_id, members)
+    rows = []
+    for member in random.sample(guild.members, min(subscribers, members)):
+        for word in random.sample(vocabulary, keywords):
+            rows.append((guild_id, member.id, word))
+    return guild, rows
+
+
+def make_messages(guild: FakeGuild, rows: list, count: int, match_rate: float, embed_rate: float=0.05) -> list:
+    # Make a stream of messages, match_rate of which contain a keyword
+    words = [w for g, u, w in rows] or ['nothing']
+    messages = []
+    for _ in range(count):
+        text = random.choices(FILLER, k=random.randint(3, 30))
+        if random.random() < match_rate:
+            text.insert(random.randrange(len(text) + 1), random.choice(words))
+        author = random.choice(guild.members)
+        channel = random.choice(guild.text_channels)
+        embeds = []
+        if random.random() < embed_rate:
+            fields = [FakeField(random.choice(FILLER), ' '.join(random.choices(FILLER, k=20))) for _ in range(5)]
+            embeds.append(FakeEmbed(' '.join(random.choices(FILLER, k=5)), ' '.join(random.choices(FILLER, k=50)), fields))
+        messages.append(FakeMessage(' '.join(text), author, channel, embeds))
+    return messages
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Memory allocated by reading a cached guild once per message.
+'before' copies every user's words into a new dict of lists like the old
+Cache.get_guild did, 'after' is the snapshot returned by Cache.get_guild.
+
+Usage: python3 benchmarks/get_guild.py (needs Python 3.9+ for reset_peak)
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cogs.utils.cache import Cache
+
+VOCABULARY = [f'word{i}' for i in range(2000)]
+WORDS_PER_USER = 5
+MESSAGES = 1000
+
+
+def before(cache: Cache, guild_id: int) -> dict:
+    userlist = {}
+    for user in cache.peek(guild_id).get_users():
+        userlist[user.id] = list(user.words)
+    return userlist
+
+
+def after(cache: Cache, guild_id: int):
+    return cache.get_guild(guild_id)
+
+
+def allocated(func, cache: Cache) -> int:
+    # Peak bytes allocated per message, including memory freed again
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    peak = 0
+    for _ in range(MESSAGES):
+        tracemalloc.reset_peak()
+        func(cache, 0)
+        current, message_peak = tracemalloc.get_traced_memory()
+        peak += message_peak - start
+    tracemalloc.stop()
+    return peak // MESSAGES
+
+
+def main() -> None:
+    random.seed(0)
+    print(f"{'subscribers':>12} {'before (B/msg)':>15} {'after (B/msg)':>14}")
+    for n in (100, 300, 1000):
+        cache = Cache(1)
+        data = [{'user': u, 'word': w} for u in range(n)
+                for w in random.sample(VOCABULARY, WORDS_PER_USER)]
+        cache.add_guild(0, data)
+        cache.get_guild(0)
+        old = allocated(before, cache)
+        new = allocated(after, cache)
+        print(f'{n:>12} {old:>15} {new:>14}')
+
+
+if __name__ == '__main__':
+    main()
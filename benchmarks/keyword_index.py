@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Per-message cost of keyword matching as the number of subscribers grows.
+'before' is the old loop over every user and word, 'after' is the guild's
+inverted index and compiled matcher.
+
+Usage: python3 benchmarks/keyword_index.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cogs.utils.cache import Guild, User
+from cogs.utils.text import normalize
+
+VOCABULARY = [f'word{i}' for i in range(2000)]
+WORDS_PER_USER = 5
+MESSAGES = [
+    'nothing to see here, just a normal message without any keywords',
+    'hey <@!1234> did you see what word42 said about word1337 yesterday?',
+]
+
+
+def clean_mentions(message: str) -> str:
+    return re.sub(r"<@[!&]?([\d]+)>", r"<@\1>", message) if message else ""
+
+
+def before(users: dict, message: str) -> list:
+    hits = []
+    for user_id, words in users.items():
+        for word in words:
+            if re.search(r"\b" + re.escape(word) + r"\b", clean_mentions(message), re.I):
+                hits.append(user_id)
+                break
+    return hits
+
+
+def after(guild: Guild, message: str) -> list:
+    return guild.get_matcher().search(normalize(message))
+
+
+def main() -> None:
+    random.seed(0)
+    print(f"{'subscribers':>12} {'message':>8} {'before (us)':>12} {'after (us)':>12}")
+    for n in (10, 100, 1000, 5000):
+        users = {i: random.sample(VOCABULARY, WORDS_PER_USER) for i in range(n)}
+        guild = Guild(0)
+        for user_id, words in users.items():
+            guild.add_user(User(user_id, words))
+        guild.get_matcher()
+
+        for m, message in enumerate(MESSAGES):
+            number = max(1, 2000 // n)
+            old = timeit.timeit(lambda: before(users, message), number=number)
+            new = timeit.timeit(lambda: after(guild, message), number=number * 10)
+            print(f'{n:>12} {m:>8} {old / number * 1e6:>12.1f} {new / number / 10 * 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Load test for message handling by Keywords, Okaeri and DT through the
+message router, using fake Discord objects and an in-memory database. Reports messages per
+second, per-message latency percentiles and bytes allocated per message as
+guild size, keyword count and match rate vary.
+
+Usage: python3 benchmarks/on_message.py [--messages 2000] [--out results.json]
+                                        [--compare old.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from cogs.dt import DT
+from cogs.keywords import Keywords
+from cogs.okaeri import Okaeri
+from fakes import FakeBot, MemoryPool, make_guild, make_messages
+
+VOCABULARY = [f'word{i}' for i in range(5000)]
+
+# (members, subscribers, keywords per subscriber, match rate)
+CASES = [
+    (100, 20, 5, 0.1),
+    (1000, 200, 5, 0.1),
+    (10000, 2000, 5, 0.1),
+    (10000, 2000, 20, 0.1),
+    (10000, 2000, 5, 0.5),
+    (10000, 2000, 5, 0.0),
+]
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_case(members: int, subscribers: int, keywords: int, match_rate: float, count: int) -> dict:
+    random.seed(0)
+    guild, rows = make_guild(1, members, subscribers, keywords, VOCABULARY)
+    messages = make_messages(guild, rows, count, match_rate)
+    bot = FakeBot(guild.members)
+
+    keywords_cog = Keywords(bot)
+    keywords_cog.keywords.pool = MemoryPool(rows)
+    Okaeri(bot), DT(bot)
+    dispatch = bot.router.dispatch
+
+    # Warm up the cache so the first miss doesn't count
+    await dispatch(messages[0])
+
+    latency = []
+    begin = time.perf_counter()
+    for message in messages:
+        start = time.perf_counter()
+        await dispatch(message)
+        latency.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - begin
+
+    # Allocations in a separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    allocated = 0
+    for message in messages[:200]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        await dispatch(message)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - base
+    tracemalloc.stop()
+
+    await keywords_cog.dispatcher.join()
+    keywords_cog.cog_unload()
+    return {
+        'members': members,
+        'subscribers': subscribers,
+        'keywords': keywords,
+        'match_rate': match_rate,
+        'messages_per_second': round(count / elapsed, 1),
+        'p50_us': round(percentile(latency, 0.5) * 1e6, 1),
+        'p95_us': round(percentile(latency, 0.95) * 1e6, 1),
+        'p99_us': round(percentile(latency, 0.99) * 1e6, 1),
+        'bytes_per_message': allocated // min(200, count),
+        'notifications': keywords_cog.dispatcher.sent,
+    }
+
+
+def print_results(results: list, baseline: list=None) -> None:
+    old = {}
+    for r in baseline or []:
+        old[(r['members'], r['subscribers'], r['keywords'], r['match_rate'])] = r
+    print(f"{'members':>8} {'subs':>6} {'kw':>4} {'match':>6} {'msg/s':>10} {'p50 us':>9}"
+          f" {'p95 us':>9} {'p99 us':>9} {'B/msg':>9}")
+    for r in results:
+        line = (f"{r['members']:>8} {r['subscribers']:>6} {r['keywords']:>4} {r['match_rate']:>6}"
+                f" {r['messages_per_second']:>10} {r['p50_us']:>9} {r['p95_us']:>9}"
+                f" {r['p99_us']:>9} {r['bytes_per_message']:>9}")
+        before = old.get((r['members'], r['subscribers'], r['keywords'], r['match_rate']))
+        if before:
+            change = r['messages_per_second'] / before['messages_per_second'] - 1
+            line += f'  ({change:+.0%} msg/s)'
+        print(line)
+
+
+async def main(args: argparse.Namespace) -> None:
+    # DT sends images by relative path
+    os.chdir(ROOT)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = [await run_case(*case, args.messages) for case in CASES]
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.out:
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        with open(args.out, 'w') as f:
+            json.dump({'commit': commit, 'time': time.time(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--out', help='save results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
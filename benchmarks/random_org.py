@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the random.org JSON-RPC API, implementing only
+generateIntegers. Latency, errors and quota exhaustion can be injected to
+check how the Dice cog copes. Point the bot at it with random_url in
+config.yaml.
+
+Usage: python3 benchmarks/random_org.py [--port 8080] [--latency 0.1]
+       [--jitter 0.05] [--error-rate 0.1] [--quota 250000]
+"""
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+class RandomOrg:
+    def __init__(self, latency: float=0, jitter: float=0, error_rate: float=0, quota: int=250000) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bits_left = quota
+        self.calls = 0
+        self.integers = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        await asyncio.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        # Injected failure, either a broken server or a JSON-RPC error
+        if random.random() < self.error_rate:
+            if random.random() < 0.5:
+                return web.Response(status=503, text='Service Unavailable')
+            return self._error(None, 500, 'Internal error')
+
+        try:
+            body = await request.json()
+        except ValueError:
+            return self._error(None, -32700, 'Parse error')
+        request_id = body.get('id')
+        if body.get('method') != 'generateIntegers':
+            return self._error(request_id, -32601, 'Method not found')
+
+        params = body.get('params', {})
+        try:
+            n, low, high = int(params['n']), int(params['min']), int(params['max'])
+        except (KeyError, TypeError, ValueError):
+            return self._error(request_id, -32602, 'Invalid params')
+        if not 1 <= n <= 10000 or not -1e9 <= low <= high <= 1e9:
+            return self._error(request_id, -32602, 'Invalid params')
+
+        # random.org charges bits for the information in the result
+        bits = n * max(1, (high - low).bit_length())
+        if bits > self.bits_left:
+            return self._error(request_id, 402, 'The API key you specified has run out of bits')
+        self.bits_left -= bits
+        self.integers += n
+
+        return web.json_response({
+            'jsonrpc': '2.0',
+            'result': {
+                'random': {'data': [random.randint(low, high) for _ in range(n)]},
+                'bitsUsed': bits,
+                'bitsLeft': self.bits_left,
+                'advisoryDelay': 0,
+            },
+            'id': request_id,
+        })
+
+    def _error(self, request_id, code: int, message: str) -> web.Response:
+        return web.json_response({
+            'jsonrpc': '2.0',
+            'error': {'code': code, 'message': message},
+            'id': request_id,
+        })
+
+
+async def start(server: RandomOrg, port: int=0) -> tuple:
+    # Serve on localhost, returns the runner and the endpoint URL
+    app = web.Application()
+    app.router.add_post('/json-rpc/2/invoke', server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/json-rpc/2/invoke'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--quota', type=int, default=250000)
+    args = parser.parse_args()
+
+    server = RandomOrg(args.latency, args.jitter, args.error_rate, args.quota)
+    loop = asyncio.get_event_loop()
+    runner, url = loop.run_until_complete(start(server, args.port))
+    print(f'Serving generateIntegers at {url}')
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(runner.cleanup())
+
+
+if __name__ == '__main__':
+    main()
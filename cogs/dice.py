@@ -1,25 +1,100 @@
-import json
+import asyncio
 import random
+from collections import deque
 
-import requests
+import aiohttp
 from discord.ext.commands import Bot, BucketType, Cog, Context, command, cooldown
 
 from .utils.logs import *
 
 
+class EntropyPool:
+    """
+    Buffer of random bits. Numbers are added with a fixed number of bits
+    each and bits are taken off the top, so every bit is used exactly once.
+    Bits are kept as a queue of the numbers they came in, so taking a few
+    costs the same however many are left.
+    """
+
+    def __init__(self) -> None:
+        # (number, width) pairs, oldest first. Only the front one can have
+        # had some of its top bits taken.
+        self.chunks = deque()
+        self.size = 0
+        self.added = 0
+        self.taken = 0
+
+    def add(self, numbers: list, width: int) -> None:
+        # Append numbers in [0, 2**width) to the pool
+        self.chunks.extend((number, width) for number in numbers)
+        self.size += len(numbers) * width
+        self.added += len(numbers) * width
+
+    def take(self, width: int) -> int:
+        # Remove width bits from the pool as a number in [0, 2**width)
+        if width > self.size:
+            raise ValueError(f'Only {self.size} bits left, need {width}')
+        self.size -= width
+        self.taken += width
+        number = 0
+        while width:
+            chunk, bits = self.chunks[0]
+            if bits <= width:
+                # Use up the whole front number
+                self.chunks.popleft()
+                number = (number << bits) | chunk
+                width -= bits
+            else:
+                # Take its top bits and leave the rest at the front
+                rest = bits - width
+                number = (number << width) | (chunk >> rest)
+                self.chunks[0] = (chunk & ((1 << rest) - 1), rest)
+                width = 0
+        return number
+
+
 class RandomAPI:
-    def __init__(self, api_key: str) -> None:
+    """
+    Async random.org client. Rolls of any range are drawn from one pool of
+    random bits fetched from random.org in bulk, which gets refilled in the
+    background once it runs low, so rolls rarely wait for random.org.
+    """
+    url = "https://api.random.org/json-rpc/2/invoke"
+    timeout = 5
+    retries = 3
+    backoff = 0.5
+
+    # random.org allows at most 1e9 as max, so fetch 29 bit numbers
+    width = 29
+    # Numbers per request, and most random.org allows in one request
+    batch = 64
+    max_batch = 10000
+    # Refill once the pool has fewer bits than this
+    low_water = 512
+    # Rolls needing more bits than this use pseudorandom numbers instead
+    max_bits = 100000
+
+    def __init__(self, api_key: str, url: str=None) -> None:
         self.api_key = api_key
-        self.cache = []
-        self.d1k = []
-        self.cache_size = 20
-
-    def _api_request(self, i: int, j: int, n: int) -> list:
+        # Point at a stand-in server for testing, see benchmarks/random_org.py
+        if url is not None:
+            self.url = url
+        self.session = None
+        self.pool = EntropyPool()
+        self.filling = None
+        self.requests = 0
+
+    async def _api_request(self, i: int, j: int, n: int) -> list:
         """ Get a number from random.org """
 
+        # Reuse one session so connections to random.org are kept alive
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
         # JSON request to random.org API
-        url = "https://api.random.org/json-rpc/2/invoke"
-        headers = {'content-type': 'application/json'}
         payload = {
             "jsonrpc": "2.0",
             "method": "generateIntegers",
@@ -31,11 +106,20 @@ class RandomAPI:
             },
             "id": 0
         }
-        response = requests.post(url, data=json.dumps(payload), headers=headers).json()
-        assert response["id"] == 0
+
+        # Retry with exponential backoff if the request fails or times out
+        response = {}
+        for attempt in range(self.retries):
+            try:
+                async with self.session.post(self.url, json=payload) as resp:
+                    response = await resp.json(content_type=None)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                if attempt < self.retries - 1:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
 
         # If something went wrong, generate pseudorandom number
-        if "result" not in response:
+        if response.get("id") != 0 or "result" not in response:
             result = [random.randint(min(i, j), max(i, j)) for x in range(n)]
 
         # Grab the result
@@ -44,33 +128,68 @@ class RandomAPI:
 
         return result
 
-    def roll(self, i: int, j: int, n: int=1) -> list:
-        """ Return cached result if any, generate otherwise."""
+    def start(self) -> None:
+        """ Fill the pool in the background."""
+        self._refill(self.batch)
 
-        # No roll needed if same
-        if i == j:
-            result = [i for x in range(n)]
-
-        # Generate standard roll, from cache if available
-        elif (i == 1 and j == 6):
-            if len(self.cache) == 0:
-                self.cache += self._api_request(1, 6, self.cache_size)
-            result = self.cache[0:n]
-            del self.cache[0]
-
-        # Generate d1k roll, from cache if available
-        elif (i == 1 and j == 1000):
-            if len(self.d1k) == 0:
-                self.d1k += self._api_request(1, 1000, self.cache_size)
-            result = self.d1k[0:n]
-            del self.d1k[0]
-
-        # Generate non-standard dice roll
-        else:
-            result = self._api_request(i, j, n)
+    def _refill(self, n: int) -> asyncio.Future:
+        # Fetch n more numbers into the pool unless already fetching
+        if self.filling is None:
+            self.filling = asyncio.ensure_future(self._fill(min(n, self.max_batch)))
+        return self.filling
+
+    async def _fill(self, n: int) -> None:
+        try:
+            self.requests += 1
+            self.pool.add(await self._api_request(0, 2 ** self.width - 1, n), self.width)
+        finally:
+            self.filling = None
+
+    async def roll(self, i: int, j: int, n: int=1) -> list:
+        """ Return n rolls between i and j inclusive from the pool."""
+        low, high = min(i, j), max(i, j)
 
+        # No roll needed if same
+        if low == high:
+            return [low for x in range(n)]
+
+        # Draw just enough bits to cover the range and throw away draws that
+        # land past the end of it, so every number is equally likely.
+        span = high - low + 1
+        width = (span - 1).bit_length()
+
+        # Too big to be worth spending random.org quota on
+        if width > 31 or n * width > self.max_bits:
+            return [random.randint(low, high) for x in range(n)]
+
+        result = []
+        while len(result) < n:
+            if self.pool.size < width:
+                # Each draw succeeds more than half the time, so ask for
+                # enough bits for twice the rolls left
+                needed = 2 * (n - len(result)) * width // self.width + 1
+                await asyncio.shield(self._refill(max(needed, self.batch)))
+                continue
+            number = self.pool.take(width)
+            if number < span:
+                result.append(low + number)
+
+        if self.pool.size < self.low_water:
+            self._refill(self.batch)
         return result
 
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'bits fetched': self.pool.added,
+            'bits used': self.pool.taken,
+            'bits left': self.pool.size,
+        }
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
 
 class Dice(Cog):
     """
@@ -83,13 +202,15 @@ class Dice(Cog):
 
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
-        self.dice = RandomAPI(bot.keys['random'])
+        self.dice = RandomAPI(bot.keys['random'], bot.random_url)
+
+    def cog_unload(self) -> None:
+        self.bot.loop.create_task(self.dice.close())
 
-    # Initialise dice cache on start up
+    # Initialise dice cache on start up without waiting for it
     @Cog.listener()
     async def on_ready(self) -> None:
-        self.dice.roll(1, 6)     # initialise dice cache
-        self.dice.roll(1, 1000)  # initialise d1k cache
+        self.dice.start()
 
     @command()
     @cooldown(5, 60, BucketType.user)
@@ -107,7 +228,7 @@ class Dice(Cog):
         except ValueError:
             return
         async with ctx.typing():
-            result = self.dice.roll(i, j, n)
+            result = await self.dice.roll(i, j, n)
         await self._send(ctx, result)
 
     async def _send(self, ctx: Context, result: list) -> None:
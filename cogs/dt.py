@@ -1,25 +1,23 @@
-import re
-
-from discord import File, Message
 from discord.ext.commands import Bot, Cog
 
+from .utils.router import Envelope
+from .utils.triggers import EMPTY
+
 
 class DT(Cog):
     """Features for DT's Discord server."""
 
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
+        bot.router.add('dt', self.on_message, lambda m: m.dt)
+
+    def cog_unload(self) -> None:
+        self.bot.router.remove('dt')
 
-    @Cog.listener()
-    async def on_message(self, message: Message) -> None:
-        if message.channel.id not in self.bot.dt:
-            return
-            
-        if re.search("(^|\W)dumb bran($|\W)", message.content, re.I):
-            await message.channel.send(file=File('images/dumb_bran.png'))
-        
-        elif re.search("(^|\W)boi($|\W)", message.content, re.I):
-            await message.channel.send(file=File('images/boi.jpg'))
+    async def on_message(self, envelope: Envelope) -> None:
+        trigger = self.bot.triggers.get('dt', EMPTY).match(envelope.text)
+        if trigger is not None:
+            await trigger.send(envelope.message.channel)
 
 
 def setup(bot: Bot) -> None:
@@ -1,152 +1,568 @@
+import asyncio
 import re
+import threading
+import time
+import uuid
 
 import pymysql.cursors
-from discord import Guild, Member, Message, Forbidden
+from discord import Guild, Member, Message, Forbidden, Role, TextChannel
 from discord.ext.commands import Bot, Cog, Context, group
 
 from .utils.logs import *
-from .utils.cache import Cache
+from .utils.cache import Cache, GuildView
+from .utils.matcher import Matcher
+from .utils.metrics import DATABASE_SECONDS, LISTENER_SECONDS, NOTIFICATIONS, timed
+from .utils.notify import Coalescer, Dispatcher
+from .utils.pool import Pool
+from .utils import snapshot
+from .utils.router import Envelope
+from .utils.text import Bundle
+from .utils.visibility import Visibility
+from .utils.writes import WriteBehind
 
 
 class Database:
     def __init__(self, db) -> None:
-        self.conn = pymysql.connect(
-            unix_socket = db['socket'],
-            user = db['user'],
-            password = db['password'],
-            db = db['database'],
-            charset = 'utf8mb4',
-            cursorclass = pymysql.cursors.DictCursor
+        # Queries run on a pool of connections in other threads, but the
+        # cache is only ever touched from the event loop.
+        self.pool = Pool(db, db.get('pool_size', 4))
+        self.cache = Cache(db.get('cache_size', 5), db.get('cache_policy', 'lfu'))
+        self.loading = {}
+        # Number of writes committed since startup. Guilds read from the
+        # database while it changed may be missing the change, because the
+        # cache skipped it while the guild wasn't in it yet. See _generation().
+        self.committed = 0
+
+        # Changes get recorded in the journal for other processes sharing
+        # the database, tagged with this process so we can skip our own.
+        self.journal = db.get('journal', False)
+        self.origin = uuid.uuid4().hex
+        self.version = None
+        # Versions below self.version we haven't seen, mapped to when we
+        # first missed them. They may be from transactions that committed
+        # late, or rolled back and never will.
+        self.gaps = {}
+        self.gap_timeout = db.get('journal_gap_timeout', 60)
+        self.max_gaps = 1000
+        # Entries are pruned after retention hours, so we can only miss
+        # some if we haven't read the journal for that long
+        self.retention = db.get('journal_retention', 24)
+        self.followed = None
+
+        # IDs of everyone with guild mappings, i.e. everyone who ever added
+        # a keyword and didn't clear them, so is_new_user() rarely needs the
+        # database. None until loaded, changes meanwhile are kept in changes.
+        self.known = None
+        self.changes = {}
+        # Coroutine function called with the ID of a user another process
+        # added. That process only knows the guilds on its own shards, so
+        # this one adds the user to the guilds on ours.
+        self.on_new_user = None
+
+        # Guild membership changes are written in batches in the background,
+        # see WriteBehind for what that means if the bot crashes.
+        self.writes = WriteBehind(
+            self.pool,
+            self._write,
+            max_pending = db.get('flush_size', 500),
+            interval = db.get('flush_interval', 1.0)
         )
-        self.cache = Cache(5)
 
-    def get_guild(self, guild: int) -> dict:
-        # If guild isn't in cache, update cache
-        if guild not in self.cache.keys():
-            with self.conn.cursor() as cursor:
-                query = "CALL get_words (%s)"
-                cursor.execute(query, (guild,))
-                results = cursor.fetchall()
-            self.cache.add_guild(guild, results)
+    @timed(DATABASE_SECONDS, method='get_guild')
+    async def get_guild(self, guild: int) -> GuildView:
+        # Get read-only snapshot of guild from cache
+        view = self.cache.get_guild(guild)
 
-        # Return guild from cache
-        return self.cache.get_guild(guild)
+        # If guild isn't in cache, update cache
+        if view is None:
+            cached = await self._load_guild(guild)
+            view = cached.get_view()
+        return view
+
+    async def _load_guild(self, guild: int):
+        # Messages that arrive while a guild is loading wait for the same
+        # query instead of starting their own.
+        if guild not in self.loading:
+            self.loading[guild] = asyncio.ensure_future(self._cache_guild(guild))
+        try:
+            return await asyncio.shield(self.loading[guild])
+        finally:
+            self.loading.pop(guild, None)
+
+    def _generation(self) -> tuple:
+        # Changes whenever a write gets committed or a batch of membership
+        # changes stops being in flight, either way a read that overlapped
+        # it may or may not have seen it
+        return self.committed, self.writes.settled
+
+    async def _cache_guild(self, guild: int):
+        # Read a guild and add it to cache, reading it again if a write got
+        # committed in the meantime. Checking and adding happen without
+        # awaiting in between, so no write can slip past.
+        while True:
+            generation = self._generation()
+            results = await self._fetch_guild(guild)
+            cached = self.cache.peek(guild)
+            if cached is not None:
+                return cached
+            if self._generation() == generation:
+                return self.cache.add_guild(guild, results)
+
+    async def _fetch_guild(self, guild: int) -> list:
+        # Get a guild's keyword rows, with membership changes that haven't
+        # been written yet applied on top. The cache skipped them because
+        # the guild wasn't in it.
+        query = "CALL get_words (%s)"
+        results = await self.pool.fetchall(query, (guild,))
+        pending = {key[2]: join for key, join in self.writes.find(
+            lambda key: key[0] == 'member' and key[1] == guild)}
+        if not pending:
+            return results
+
+        rows = [r for r in results if pending.get(int(r['user']), True)]
+        present = set(int(r['user']) for r in rows)
+        for user, join in pending.items():
+            if join and user not in present:
+                rows.extend({'user': user, 'word': word} for word in await self.get_words(user))
+        return rows
+
+    @timed(DATABASE_SECONDS, method='warm_up')
+    async def warm_up(self, guilds: list) -> int:
+        # Load guilds into cache in bulk, in the given order of priority,
+        # until the cache is full. Returns the number of guilds loaded.
+        space = self.cache.capacity - len(self.cache.keys())
+        guilds = [g for g in guilds if self.cache.peek(g) is None][:max(space, 0)]
+        if not guilds:
+            return 0
+
+        # Membership changes the cache skipped need to be in the database
+        await self.writes.flush()
+        loop = asyncio.get_event_loop()
+        full = threading.Event()
+        loaded = []
+        generation = self._generation()
+
+        def add_guild(guild, rows):
+            # Runs on the event loop. Guilds that got loaded by a message in
+            # the meantime are fresher than ours, and a cache that filled up
+            # with real traffic shouldn't have guilds evicted for warm-up.
+            # Once something was written, rows still to come may be missing
+            # it, so leave the rest to be loaded when they're needed.
+            if len(self.cache.keys()) >= self.cache.capacity or self._generation() != generation:
+                full.set()
+            elif self.cache.peek(guild) is None and guild not in self.loading:
+                self.cache.add_guild(guild, rows)
+                loaded.append(guild)
+
+        def warm_up(cursor):
+            # Stream the whole guilds-keywords join with a server-side cursor
+            # and hand each guild's rows to the event loop as soon as they're
+            # complete, so only one guild is held here at a time.
+            placeholders = ', '.join(['%s'] * len(guilds))
+            query = ("SELECT g.`guild`, k.`user`, k.`word` FROM `guilds` g "
+                     "JOIN `keywords` k ON k.`user` = g.`user` "
+                     f"WHERE g.`guild` IN ({placeholders}) "
+                     f"ORDER BY FIELD(g.`guild`, {placeholders})")
+            cursor.execute(query, (*guilds, *guilds))
+
+            # Guilds without rows have no users, cache them empty in order
+            order = iter(guilds)
+            current, rows = None, []
+            for row in cursor.fetchall_unbuffered():
+                if full.is_set():
+                    return
+                guild = int(row['guild'])
+                if guild != current:
+                    if current is not None:
+                        loop.call_soon_threadsafe(add_guild, current, rows)
+                    for skipped in order:
+                        if skipped == guild:
+                            break
+                        loop.call_soon_threadsafe(add_guild, skipped, [])
+                    current, rows = guild, []
+                rows.append(row)
+            if current is not None:
+                loop.call_soon_threadsafe(add_guild, current, rows)
+            for skipped in order:
+                loop.call_soon_threadsafe(add_guild, skipped, [])
 
-    def add_guild(self, guild: Guild) -> None:
+        try:
+            # The loop runs the handed over guilds before the query's result
+            await self.pool.run(warm_up, cursorclass=pymysql.cursors.SSDictCursor)
+        finally:
+            # Stop streaming if we got cancelled
+            full.set()
+        return len(loaded)
+
+    @timed(DATABASE_SECONDS, method='restore')
+    async def restore(self, path: str, guilds: list) -> int:
+        # Load guilds into cache from a snapshot file, in the given order of
+        # priority, until the cache is full. Guilds whose keywords changed
+        # since the snapshot are left out. Returns the number of guilds loaded.
+        loop = asyncio.get_event_loop()
+        try:
+            saved = await loop.run_in_executor(None, snapshot.load, path)
+        except (OSError, ValueError) as err:
+            log.warning(f'Ignoring keyword snapshot: {err}')
+            return 0
+
+        space = self.cache.capacity - len(self.cache.keys())
+        guilds = [g for g in guilds if g in saved and self.cache.peek(g) is None][:max(space, 0)]
+        if not guilds:
+            return 0
+
+        # Membership changes the cache skipped need to be in the database,
+        # so guilds they touched fail the checksum instead of missing them
+        await self.writes.flush()
+        generation = self._generation()
+
+        # Compare row count and checksum of every guild with the database
+        placeholders = ', '.join(['%s'] * len(guilds))
+        query = ("SELECT g.`guild`, COUNT(*) AS `count`, "
+                 "SUM(CRC32(CONCAT(g.`user`, ':', k.`word`))) AS `checksum` "
+                 "FROM `guilds` g JOIN `keywords` k ON k.`user` = g.`user` "
+                 f"WHERE g.`guild` IN ({placeholders}) GROUP BY g.`guild`")
+        results = await self.pool.fetchall(query, guilds)
+        current = {int(r['guild']): (r['count'], int(r['checksum'])) for r in results}
+        if self._generation() != generation:
+            # Checksums may be from before the write
+            return 0
+
+        loaded = 0
+        for guild in guilds:
+            if len(self.cache.keys()) >= self.cache.capacity:
+                break
+            usage, users = saved[guild]
+            rows = [(u, w) for u, words in users.items() for w in words]
+            if snapshot.checksum(rows) != current.get(guild, (0, 0)):
+                continue
+            if self.cache.peek(guild) is None and guild not in self.loading:
+                cached = self.cache.add_guild(guild, [{'user': u, 'word': w} for u, w in rows])
+                cached.usage = max(usage, 1)
+                loaded += 1
+        return loaded
+
+    @timed(DATABASE_SECONDS, method='add_guild')
+    async def add_guild(self, guild: Guild) -> None:
         # This gets called when Senko joins a new guild. Don't add to cache.
-        # Get all existing users.
-        with self.conn.cursor() as cursor:
+        # Write out pending changes first, they may be from before Senko last
+        # left this guild.
+        await self.writes.flush()
+        members = [m.id for m in guild.members]
+
+        def add_guild(cursor):
+            # Get all existing users.
             query = "SELECT DISTINCT `user` FROM `keywords`"
             cursor.execute(query)
-            results = cursor.fetchall()
-        all_users = [r['user'] for r in results]
-
-        # Add new guild mapping for users who are in this guild
-        with self.conn.cursor() as cursor:
-            for member in guild.members:
-                if str(member.id) in all_users:
-                    query = "INSERT INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
-                    cursor.execute(query, (guild.id, member.id))
-        self.conn.commit()
-
-    def remove_guild(self, guild: Guild) -> None:
-        # Remove guild mappings from database and cache
-        with self.conn.cursor() as cursor:
-            query = "DELETE FROM `guilds` WHERE `guild`=%s"
-            cursor.execute(query, (guild.id,))
-        self.conn.commit()
+            all_users = set(int(r['user']) for r in cursor.fetchall())
+
+            # Add new guild mapping for users who are in this guild,
+            # all in one multi-row insert. Some may be left over from before,
+            # if Senko was removed while offline and never heard about it.
+            rows = [(guild.id, m) for m in members if m in all_users]
+            query = "INSERT IGNORE INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
+            cursor.executemany(query, rows)
+            self._record(cursor, 'add_member', [(g, u, None) for g, u in rows])
+
+        await self.pool.run(add_guild)
+        self.committed += 1
+
+    @timed(DATABASE_SECONDS, method='remove_guild')
+    async def remove_guild(self, guild: Guild) -> None:
+        # Remove guild mappings from database and cache. Pending changes to
+        # its members don't matter anymore.
+        self.writes.discard(lambda key: key[0] == 'member' and key[1] == guild.id)
+        self.writes.put(('guild', guild.id), False)
         self.cache.remove_guild(guild.id)
 
-    def add_guild_member(self, guild: int, member: int) -> None:
+    @timed(DATABASE_SECONDS, method='add_guild_member')
+    async def add_guild_member(self, guild: int, member: int) -> None:
         # This gets called when someone joins a guild that Senko is in.
         # If member is an existing user, add new guild mapping in database.
-        if not self.is_new_user(member):
-            with self.conn.cursor() as cursor:
-                query = "INSERT INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
-                cursor.execute(query, (guild, member))
-            self.conn.commit()
-            self.cache.add_guild_member(guild, member)
+        if not await self.is_new_user(member):
+            await self.add_user_guilds([guild], member)
+
+    async def add_user_guilds(self, guilds: list, user: int) -> None:
+        # Add guild mappings for a user who's already in the database
+        for guild in guilds:
+            self.writes.put(('member', guild, user), True)
+            self.cache.add_guild_member(guild, user)
 
             # Update cache if the guild is in cache.
-            if self.cache.has_user(member):
-                self.cache.add_guild_member(guild, member)
+            if self.cache.has_user(user):
+                self.cache.add_guild_member(guild, user)
 
             # If the user isn't already in cache, we need to add them.
             else:
-                words = self.get_words(member)
-                self.cache.add_user([guild], member, words)
+                words = await self.get_words(user)
+                self.cache.add_user([guild], user, words)
 
-    def remove_guild_member(self, guild: int, member: int) -> None:
+    @timed(DATABASE_SECONDS, method='remove_guild_member')
+    async def remove_guild_member(self, guild: int, member: int) -> None:
         # This gets called when someone leave a guild that Senko is in.
-        # Don't need to check if this guild-user mapping actually exists.
-        with self.conn.cursor() as cursor:
-            query = "DELETE FROM `guilds` WHERE `guild`=%s AND `user`=%s"
-            cursor.execute(query, (guild, member))
-        self.conn.commit()
+        # Don't need to check if this guild-user mapping actually exists,
+        # but known users tell us when it can't.
+        if self.known is None or member in self.known:
+            self.writes.put(('member', guild, member), False)
         self.cache.remove_guild_member(guild, member)
 
-    def get_words(self, user: int) -> list:
+    def _write(self, cursor, changes: list) -> None:
+        # Write a batch of membership changes from self.writes. Each mapping
+        # has at most one change, and changes to a guild's members only come
+        # after the guild was removed, so guilds go first, then leaves,
+        # then joins.
+        guilds = [key[1] for key, _ in changes if key[0] == 'guild']
+        left = [key[1:] for key, join in changes if key[0] == 'member' and not join]
+        joined = [key[1:] for key, join in changes if key[0] == 'member' and join]
+
+        if guilds:
+            placeholders = ', '.join(['%s'] * len(guilds))
+            cursor.execute(f"DELETE FROM `guilds` WHERE `guild` IN ({placeholders})", guilds)
+            self._record(cursor, 'remove_guild', [(g, None, None) for g in guilds])
+        if left:
+            placeholders = ', '.join(['(%s, %s)'] * len(left))
+            query = f"DELETE FROM `guilds` WHERE (`guild`, `user`) IN ({placeholders})"
+            cursor.execute(query, [i for pair in left for i in pair])
+            self._record(cursor, 'remove_member', [(g, u, None) for g, u in left])
+        if joined:
+            # Someone may have left and rejoined before the leave got written
+            query = "INSERT IGNORE INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
+            cursor.executemany(query, joined)
+            self._record(cursor, 'add_member', [(g, u, None) for g, u in joined])
+
+    @timed(DATABASE_SECONDS, method='get_words')
+    async def get_words(self, user: int) -> list:
         if self.cache.has_user(user):
             words = self.cache.get_words(user)
-        
+
         # If user isn't in cache, get from database
         else:
-            with self.conn.cursor() as cursor:
-                query = "SELECT `word` FROM `keywords` WHERE `user`=%s"
-                cursor.execute(query, (user,))
-                results = cursor.fetchall()
+            query = "SELECT `word` FROM `keywords` WHERE `user`=%s"
+            results = await self.pool.fetchall(query, (user,))
             words = [r['word'] for r in results]
         return words
 
-    def add_words(self, user: int, words: list) -> None:
+    @timed(DATABASE_SECONDS, method='add_words')
+    async def add_words(self, user: int, words: list) -> None:
         # Add words to database
-        with self.conn.cursor() as cursor:
-            for word in words:
+        def add_words(cursor):
+            query = "INSERT INTO `keywords` (`user`, `word`) VALUES (%s, %s)"
+            rows = [(user, word) for word in set(words)]
+            # Adding a word twice is harmless, so record them all
+            self._record(cursor, 'add_word', [(None, user, word) for user, word in rows])
+            try:
+                # Try all words in one multi-row insert first
+                cursor.executemany(query, rows)
+                return
+            except pymysql.err.IntegrityError:
+                # A failed insert doesn't insert any of its rows, so fall
+                # back to one word at a time to find the bad ones.
+                pass
+            for row in rows:
                 try:
-                    query = "INSERT INTO `keywords` (`user`, `word`) VALUES (%s, %s)"
-                    cursor.execute(query, (user, word))
+                    cursor.execute(query, row)
                 except pymysql.err.IntegrityError as err:
                     # This error gets thrown if user tries to insert a keyword
                     # they already have (unique key 'unique_keyword'). But if
                     # it's something else, print the error.
                     if 'unique_keyword' not in str(err):
-                        print(err)
-        self.conn.commit()
+                        log.error(err)
+
+        await self.pool.run(add_words)
+        self.committed += 1
 
         # If the user is cached, we need to add the words to cache too.
         if self.cache.has_user(user):
             self.cache.add_words(user, words)
 
-    def remove_words(self, user: int, words: list) -> None:
+    @timed(DATABASE_SECONDS, method='remove_words')
+    async def remove_words(self, user: int, words: list) -> None:
         # Remove words from database
-        with self.conn.cursor() as cursor:
-            for word in words:
-                query = "DELETE FROM `keywords` WHERE `user`=%s AND `word`=%s"
-                cursor.execute(query, (user, word))
-        self.conn.commit()
+        if words:
+            def remove_words(cursor):
+                placeholders = ', '.join(['%s'] * len(words))
+                query = f"DELETE FROM `keywords` WHERE `user`=%s AND `word` IN ({placeholders})"
+                cursor.execute(query, (user, *words))
+                self._record(cursor, 'remove_word', [(None, user, word) for word in words])
+
+            await self.pool.run(remove_words)
+            self.committed += 1
 
         # Update cache
         self.cache.remove_words(user, words)
 
-    def is_new_user(self, user: int) -> bool:
-        # Check if a user is in database or not. Check cache first.
+    @timed(DATABASE_SECONDS, method='load_known_users')
+    async def load_known_users(self) -> int:
+        # Load the IDs of all users. Returns how many there are.
+        self.changes = {}
+        query = "SELECT DISTINCT `user` FROM `guilds`"
+        results = await self.pool.fetchall(query)
+        known = set(int(r['user']) for r in results)
+
+        # Users added or removed while the query ran
+        for user, is_known in self.changes.items():
+            if is_known:
+                known.add(user)
+            else:
+                known.discard(user)
+        self.known = known
+        self.changes = {}
+        return len(known)
+
+    def _remember(self, user: int, is_known: bool) -> None:
+        # Update known users, or note the change if they're still loading
+        if self.known is None:
+            self.changes[user] = is_known
+        elif is_known:
+            self.known.add(user)
+        else:
+            self.known.discard(user)
+
+    @timed(DATABASE_SECONDS, method='is_new_user')
+    async def is_new_user(self, user: int) -> bool:
+        # Check if a user is in database or not. Check cache first, then the
+        # known users, and only ask the database if those aren't loaded yet.
         if self.cache.has_user(user):
             return False
-        with self.conn.cursor() as cursor:
-            query = "SELECT EXISTS (SELECT 1 FROM `guilds` WHERE `user`=%s)"
-            cursor.execute(query, (user,))
-            result = cursor.fetchone()
+        if self.known is not None:
+            return user not in self.known
+        query = "SELECT EXISTS (SELECT 1 FROM `guilds` WHERE `user`=%s)"
+        result = await self.pool.fetchone(query, (user,))
         return (0 in result.values())
 
-    def add_new_user(self, guilds: list, user: int) -> None:
+    @timed(DATABASE_SECONDS, method='add_new_user')
+    async def add_new_user(self, guilds: list, user: int) -> None:
         # This only gets called after is_new_user() so we know the user is new.
-        # Add all the guild mappings to database and add new user to cache.
-        with self.conn.cursor() as cursor:
-            for guild in guilds:
-                query = "INSERT INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
-                cursor.execute(query, (guild, user))
-        self.conn.commit()
+        # Add all the guild mappings to database and add new user to cache,
+        # after any pending changes to their old mappings.
+        await self.writes.flush()
+        def add_new_user(cursor):
+            query = "INSERT INTO `guilds` (`guild`, `user`) VALUES (%s, %s)"
+            cursor.executemany(query, [(guild, user) for guild in guilds])
+            self._record(cursor, 'add_member', [(guild, user, None) for guild in guilds])
+            self._record(cursor, 'add_user', [(None, user, None)])
+
+        await self.pool.run(add_new_user)
+        self.committed += 1
         self.cache.add_user(guilds, user, [])
+        self._remember(user, True)
+
+    @timed(DATABASE_SECONDS, method='remove_user')
+    async def remove_user(self, user: int) -> None:
+        # Remove all of a user's keywords and guild mappings, so they're a
+        # new user again as far as is_new_user() is concerned.
+        await self.writes.flush()
+        def remove_user(cursor):
+            cursor.execute("DELETE FROM `keywords` WHERE `user`=%s", (user,))
+            cursor.execute("DELETE FROM `guilds` WHERE `user`=%s", (user,))
+            self._record(cursor, 'remove_user', [(None, user, None)])
+
+        await self.pool.run(remove_user)
+        self.committed += 1
+        self.cache.remove_user(user)
+        self._remember(user, False)
+
+    def _record(self, cursor, action: str, rows: list) -> None:
+        # Add (guild, user, word) changes to the journal, in the same
+        # transaction as the change itself
+        if self.journal and rows:
+            query = ("INSERT INTO `journal` (`origin`, `action`, `guild`, `user`, `word`) "
+                     "VALUES (%s, %s, %s, %s, %s)")
+            cursor.executemany(query, [(self.origin, action, *row) for row in rows])
+
+    @timed(DATABASE_SECONDS, method='follow_journal')
+    async def follow_journal(self, limit: int=1000) -> int:
+        # Apply changes made by other processes since the last call to cache.
+        # Returns the number of changes applied.
+        if self.version is None:
+            # Everything before now is already in the database we load from
+            query = "SELECT COALESCE(MAX(`version`), 0) AS `version` FROM `journal`"
+            self.version = (await self.pool.fetchone(query))['version']
+            self.followed = time.monotonic()
+            return 0
+
+        # If entries we haven't seen got pruned, we can't tell what changed.
+        # Missing entries are usually just not committed yet though.
+        now = time.monotonic()
+        if now - self.followed > self.retention * 3600:
+            query = "SELECT MIN(`version`) AS `oldest` FROM `journal`"
+            oldest = (await self.pool.fetchone(query))['oldest']
+            if oldest is not None and oldest > self.version + 1:
+                log.warning('Fell behind the keyword journal, clearing cache')
+                self.cache.clear()
+
+        # Versions are handed out when inserting but become visible when
+        # committing, so a younger entry can show up before an older one.
+        # Keep asking for the versions we skipped over until they show up
+        # or are too old to still be coming.
+        self.gaps = {v: t for v, t in self.gaps.items() if now - t < self.gap_timeout}
+        where, args = "`version` > %s", [self.version]
+        if self.gaps:
+            placeholders = ', '.join(['%s'] * len(self.gaps))
+            where = f"({where} OR `version` IN ({placeholders}))"
+            args.extend(self.gaps)
+        query = ("SELECT `version`, `origin`, `action`, `guild`, `user`, `word` FROM `journal` "
+                 f"WHERE {where} ORDER BY `version` LIMIT %s")
+        results = await self.pool.fetchall(query, (*args, limit))
+        applied = 0
+        for r in results:
+            version = r['version']
+            if version in self.gaps:
+                del self.gaps[version]
+            elif version > self.version:
+                for missing in range(max(self.version + 1, version - self.max_gaps), version):
+                    self.gaps[missing] = now
+                self.version = version
+            else:
+                continue
+            if r['origin'] != self.origin:
+                await self._apply(r['action'], r['guild'], r['user'], r['word'])
+                applied += 1
+
+        # Don't let the query grow without bounds, give up on the oldest
+        for version in sorted(self.gaps)[:max(len(self.gaps) - self.max_gaps, 0)]:
+            del self.gaps[version]
+        self.followed = now
+        return applied
+
+    async def _apply(self, action: str, guild: int, user: int, word: str) -> None:
+        # Apply one journal entry to cache. Every change is safe to apply to
+        # a cache that already has it.
+        self.committed += 1
+        if action == 'add_word':
+            self.cache.add_words(user, [word])
+        elif action == 'remove_word':
+            self.cache.remove_words(user, [word])
+        elif action == 'add_member':
+            self._remember(user, True)
+            if self.cache.peek(guild) is None:
+                return
+            if self.cache.has_user(user):
+                self.cache.add_guild_member(guild, user)
+            else:
+                words = await self.get_words(user)
+                self.cache.add_user([guild], user, words)
+        elif action == 'remove_member':
+            self.cache.remove_guild_member(guild, user)
+        elif action == 'remove_guild':
+            self.cache.remove_guild(guild)
+        elif action == 'remove_user':
+            self.cache.remove_user(user)
+            self._remember(user, False)
+        elif action == 'add_user':
+            self._remember(user, True)
+            if self.on_new_user is not None:
+                await self.on_new_user(user)
+
+    @timed(DATABASE_SECONDS, method='prune_journal')
+    async def prune_journal(self, hours: int) -> int:
+        # Delete journal entries every process should have seen by now
+        query = "DELETE FROM `journal` WHERE `created` < NOW(6) - INTERVAL %s HOUR"
+        return await self.pool.execute(query, (hours,))
+
+    def close(self) -> None:
+        self.writes.stop()
+        self.pool.close()
 
 
 class Keywords(Cog):
@@ -159,6 +575,119 @@ class Keywords(Cog):
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
         self.keywords = Database(bot.db)
+        self.visibility = Visibility()
+
+        # Check messages in guilds, DMs have nobody to notify. Loading a
+        # guild or a full notification queue can make this wait, so it goes
+        # after the handlers that only reply.
+        bot.router.add('keywords', self.on_message, lambda m: not m.dm, priority=1)
+
+        # Notifications get sent in the background by a pool of workers
+        self.single_request = bot.notify.get('single_request', False)
+        self.dispatcher = Dispatcher(
+            self._send_notification,
+            workers = bot.notify.get('workers', 4),
+            queue_size = bot.notify.get('queue_size', 1000),
+            route_rate = bot.notify.get('route_rate', 1.0)
+        )
+        self.dispatcher.start(bot.loop)
+        self.coalescer = Coalescer(
+            window = bot.notify.get('coalesce_window', 0),
+            cooldown = bot.notify.get('keyword_cooldown', 0)
+        )
+        self.warming = None
+        self.saving = None
+
+        # Keep up with keyword changes made by other processes
+        self.following = None
+        self.keywords.on_new_user = self._add_to_guilds
+        if bot.db.get('journal', False):
+            self.following = bot.loop.create_task(self._follow_journal(
+                interval = bot.db.get('journal_interval', 5),
+                retention = self.keywords.retention
+            ))
+
+        self.keywords.writes.start(bot.loop)
+
+        # Member joins check the database until known users are loaded
+        self.loading_users = bot.loop.create_task(self._load_known_users())
+
+    def cog_unload(self) -> None:
+        self.bot.router.remove('keywords')
+        self.loading_users.cancel()
+        if self.warming is not None:
+            self.warming.cancel()
+        if self.following is not None:
+            self.following.cancel()
+        # Only save once the snapshot was restored, or we'd overwrite it with
+        # whatever little got cached before then.
+        if self.saving is not None:
+            self.saving.cancel()
+            try:
+                snapshot.save(snapshot.dump(self.keywords.cache), self.bot.db['snapshot'])
+            except OSError as err:
+                log.error(f'Failed to save keyword snapshot: {err}')
+        self.dispatcher.stop()
+        self.keywords.close()
+
+    async def _warm_up(self) -> None:
+        # Most recently active guilds first. Message IDs are snowflakes, so
+        # the largest last message ID is the latest.
+        guilds = sorted(
+            self.bot.guilds,
+            key = lambda g: max((c.last_message_id or 0 for c in g.text_channels), default=0),
+            reverse = True
+        )
+        guilds = [g.id for g in guilds]
+
+        # Guilds that are missing or stale in the snapshot get a full load
+        path = self.bot.db.get('snapshot')
+        if path:
+            loaded = await self.keywords.restore(path, guilds)
+            log.info(f'Restored {loaded} servers from keyword snapshot')
+            interval = self.bot.db.get('snapshot_interval', 600)
+            self.saving = self.bot.loop.create_task(self._save_snapshots(path, interval))
+        if self.bot.db.get('warm_up', False):
+            loaded = await self.keywords.warm_up(guilds)
+            log.info(f'Warmed up keyword cache with {loaded} servers')
+
+    async def _save_snapshots(self, path: str, interval: float) -> None:
+        # Save every so often too, in case the bot dies without unloading
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            data = snapshot.dump(self.keywords.cache)
+            try:
+                await loop.run_in_executor(None, snapshot.save, data, path)
+            except OSError as err:
+                log.error(f'Failed to save keyword snapshot: {err}')
+
+    async def _load_known_users(self) -> None:
+        try:
+            count = await self.keywords.load_known_users()
+            log.info(f'Loaded {count} known keyword users')
+        except pymysql.err.Error as err:
+            log.error(f'Failed to load known keyword users: {err}')
+
+    async def _follow_journal(self, interval: float, retention: int) -> None:
+        # Poll the journal, and prune it about once an hour. Errors are
+        # printed rather than stopping the loop, the next poll catches up.
+        pruned = self.bot.loop.time()
+        while True:
+            try:
+                await self.keywords.follow_journal()
+                if self.bot.loop.time() - pruned > 3600:
+                    pruned = self.bot.loop.time()
+                    await self.keywords.prune_journal(retention)
+            except pymysql.err.Error as err:
+                log.error(f'Failed to follow keyword journal: {err}')
+            await asyncio.sleep(interval)
+
+    async def _add_to_guilds(self, user: int) -> None:
+        # Add guild mappings for a user another process added, for the
+        # guilds on this process's shards
+        guilds = [g.id for g in self.bot.guilds if g.get_member(user) is not None]
+        await self.keywords.add_user_guilds(guilds, user)
 
     def _clean_mentions(self, message: str) -> str:
         # remove the ! or & in mentions
@@ -167,97 +696,180 @@ class Keywords(Cog):
         else:
             return ""
 
-    def _has_word(self, word: str, message: str) -> bool:
-        return re.search(r"\b" + re.escape(word) + r"\b", self._clean_mentions(message), re.I)
+    def _match(self, matcher: Matcher, bundle: Bundle) -> dict:
+        # Map each user with a keyword in the message to the quote and word
+        # of the first part it was found in. Each part gets scanned only once.
+        hits = {}
+        for fragment in bundle.fragments:
+            for user_id, word in matcher.search(fragment.text):
+                if user_id not in hits:
+                    hits[user_id] = (fragment.quote, word)
+        return hits
+
+    # Fill the cache in the background, on_ready fires again on reconnects
+    @Cog.listener()
+    async def on_ready(self) -> None:
+        fill = self.bot.db.get('warm_up', False) or self.bot.db.get('snapshot')
+        if fill and self.warming is None:
+            self.warming = self.bot.loop.create_task(self._warm_up())
 
     @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_member_join')
     async def on_member_join(self, member: Member) -> None:
         # print(f'{member.display_name} joined {member.guild.name}')
-        self.keywords.add_guild_member(member.guild.id, member.id)
+        self.visibility.update_member(member)
+        await self.keywords.add_guild_member(member.guild.id, member.id)
 
     @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_member_remove')
     async def on_member_remove(self, member: Member) -> None:
         # print(f'{member.display_name} left {member.guild.name}')
-        self.keywords.remove_guild_member(member.guild.id, member.id)
+        self.visibility.remove_member(member)
+        await self.keywords.remove_guild_member(member.guild.id, member.id)
 
     @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_join')
     async def on_guild_join(self, guild: Guild) -> None:
-        print(f'Joined new server {guild.name} ({guild.id})')
-        self.keywords.add_guild(guild)
+        log.warning(f'Joined new server {guild.name} ({guild.id})', extra={'guild': guild.id})
+        await self.keywords.add_guild(guild)
 
     @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_remove')
     async def on_guild_remove(self, guild: Guild) -> None:
-        print(f'Removed from server {guild.name} ({guild.id})')
-        self.keywords.remove_guild(guild)
+        log.warning(f'Removed from server {guild.name} ({guild.id})', extra={'guild': guild.id})
+        self.visibility.remove_guild(guild)
+        await self.keywords.remove_guild(guild)
 
     @Cog.listener()
-    async def on_message(self, message: Message) -> None:
-        # Ignore DMs
-        if message.guild is None:
-            return
+    @timed(LISTENER_SECONDS, listener='keywords.on_member_update')
+    async def on_member_update(self, before: Member, after: Member) -> None:
+        if before.roles != after.roles:
+            self.visibility.update_member(after)
+
+    @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_role_update')
+    async def on_guild_role_update(self, before: Role, after: Role) -> None:
+        if before.permissions != after.permissions:
+            self.visibility.remove_guild(after.guild)
+
+    @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_role_delete')
+    async def on_guild_role_delete(self, role: Role) -> None:
+        self.visibility.remove_guild(role.guild)
+
+    @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_channel_update')
+    async def on_guild_channel_update(self, before: TextChannel, after: TextChannel) -> None:
+        if before.overwrites != after.overwrites:
+            self.visibility.remove_channel(after.id)
 
-        # Get all users and their words in guild
-        words = self.keywords.get_guild(message.guild.id)
-        for user_id in words.keys():
+    @Cog.listener()
+    @timed(LISTENER_SECONDS, listener='keywords.on_guild_channel_delete')
+    async def on_guild_channel_delete(self, channel: TextChannel) -> None:
+        self.visibility.remove_channel(channel.id)
+
+    async def on_message(self, envelope: Envelope) -> None:
+        # Find all users in guild with words in the message
+        message = envelope.message
+        guild = await self.keywords.get_guild(message.guild.id)
+        hits = self._match(guild.matcher, envelope.bundle)
+        if hits:
+            await self._notif_loop(hits, message)
+
+    async def _notif_loop(self, hits: dict, message: Message) -> None:
+        # Only notify users who can read the channel the message was sent in
+        members = self.visibility.get_members(message.channel)
+        for user_id in hits.keys() & members:
 
             # Ignore messages from the user themselves
-            if message.author.id == int(user_id):
+            if message.author.id == user_id:
                 continue
 
-            # Check if user is in the channel that the message was sent in
-            if int(user_id) not in [m.id for m in message.channel.members]:
+            # Skip if the user was just notified about this word
+            quote, word = hits[user_id]
+            if not self.coalescer.allow(user_id, word):
                 continue
 
-            # Send notification if any words match in message or embed
-            await self._notif_loop(user_id, words[user_id], message)
-            
-
-    async def _notif_loop(self, user_id: str, keywords: list, message: Message) -> None:
-        for word in keywords:
-            if self._has_word(word, message.content):
-                await self._send_notification(user_id, message, message.clean_content, word)
-                return
-            else:
-                for embed in message.embeds:
-                    if self._has_word(word, embed.description):
-                        await self._send_notification(user_id, message, embed.description, word)
-                        return
-                    elif self._has_word(word, embed.title):
-                        await self._send_notification(user_id, message, embed.title, word)
-                        return
-                    elif embed.fields is not embed.Empty:
-                        for field in embed.fields:
-                            if self._has_word(word, field.name):
-                                await self._send_notification(user_id, message, field.name, word)
-                                return
-                            elif self._has_word(word, field.value):
-                                await self._send_notification(user_id, message, field.value, word)
-                                return
-
-    async def _send_notification(self, user_id: str, message: Message, quote: str, word: str) -> None:
+            # Queue notification for the first word that matched, or hold on
+            # to it so hits in the same channel go out as one DM
+            hit = (message, quote, word)
+            if not self.coalescer.window:
+                await self.dispatcher.put(user_id, user_id, [hit])
+            elif self.coalescer.add((user_id, message.channel.id), hit):
+                self.bot.loop.create_task(self._flush_later((user_id, message.channel.id)))
+
+    async def _flush_later(self, key: tuple) -> None:
+        # Queue everything a user got in a channel once the window closes
+        await asyncio.sleep(self.coalescer.window)
+        hits = self.coalescer.pop(key)
+        if hits:
+            await self.dispatcher.put(key[0], key[0], hits)
+
+    async def _send_notification(self, user_id: int, hits: list) -> None:
         # Get user to send message to
-        user = self.bot.get_user(int(user_id))
+        user = self.bot.get_user(user_id)
+        if user is None:
+            return
 
         # Escape backticks to avoid breaking output markdown
+        message, quote, word = hits[0]
         quote = quote.replace("`", "'")
+        if len(hits) == 1:
+            content = (f".\n**#{message.channel.name}**  {message.channel.guild}```markdown\n"
+                       f"<{message.author.display_name}> {quote}"
+                       f"```{message.jump_url}")
+            preview = f"<{message.author.display_name}> {quote}"
+        else:
+            content = self._digest(hits)
+            preview = f"<{message.author.display_name}> {quote} (+{len(hits) - 1} more)"
 
         try:
-            # Send DM to user without formatting for push notification
-            msg = await user.send(f"<{message.author.display_name}> {quote}")
+            # Send the formatted DM straight away if configured to save
+            # a request, at the cost of a less readable push notification
+            if self.single_request:
+                await user.send(content)
+
+            else:
+                # Send DM to user without formatting for push notification
+                msg = await user.send(preview[:2000])
 
-            # Edit DM with nicer formatting
-            await msg.edit(content = 
-                f".\n**#{message.channel.name}**  {message.channel.guild}```markdown\n"
-                f"<{message.author.display_name}> {quote}"
-                f"```{message.jump_url}")
+                # Edit DM with nicer formatting
+                await msg.edit(content=content)
+
+            NOTIFICATIONS.inc(result='sent')
 
             # Log message to console
-            print(f"Notify {user.name}#{user.discriminator} on keyword '{word}'")
+            words = ', '.join(sorted(set(h[2] for h in hits)))
+            log.info(f"Notify {user.name}#{user.discriminator} on keyword '{words}'", extra={
+                'guild': message.guild.id,
+                'channel': message.channel.id,
+                'user': user.id,
+            })
 
         except Forbidden as err:
+            NOTIFICATIONS.inc(result='forbidden')
             if err.code == 50007:
                 await message.channel.send(f"<@!{user.id}>, I couldn't send you a DM. Please go to 'Privacy Settings' for this server and allow direct messages from server members.")
-                print(f"Couldn't DM user {user.name}")
+                log.info(f"Couldn't DM user {user.name}", extra={'user': user.id})
+
+    def _digest(self, hits: list) -> str:
+        # Format several hits from one channel as a single DM, shortening
+        # quotes and dropping the oldest hits to fit in Discord's limit
+        message = hits[0][0]
+        header = f".\n**#{message.channel.name}**  {message.channel.guild}```markdown\n"
+        lines, links = [], []
+        for message, quote, word in reversed(hits):
+            quote = quote.replace("`", "'")
+            if len(quote) > 200:
+                quote = quote[:199] + '…'
+            line = f"<{message.author.display_name}> {quote}\n"
+            link = f"{message.jump_url}\n"
+            length = len(header) + sum(map(len, lines + links)) + len(line) + len(link) + 3
+            if lines and length > 2000:
+                break
+            lines.insert(0, line)
+            links.insert(0, link)
+        return header + ''.join(lines) + '```' + ''.join(links)
 
 
     @group(aliases=['keyword', 'keywords', 'kw'])
@@ -270,16 +882,18 @@ class Keywords(Cog):
         log_command(ctx)
 
         # This could potentially be a member's first time adding words.
-        # Then we want to also add their guild mappings to database.
-        if self.keywords.is_new_user(ctx.author.id):
-            print(f'Adding new user {ctx.author.display_name} to database')
+        # Then we want to also add their guild mappings to database. When
+        # sharded, we only see our own shards' guilds, the other processes
+        # add theirs once they read about the new user in the journal.
+        if await self.keywords.is_new_user(ctx.author.id):
+            log.info(f'Adding new user {ctx.author.display_name} to database', extra={'user': ctx.author.id})
             guilds = [g.id for g in self.bot.guilds if g.get_member(ctx.author.id) is not None]
-            self.keywords.add_new_user(guilds, ctx.author.id)
+            await self.keywords.add_new_user(guilds, ctx.author.id)
 
         # Then we'll add the words for this user
         words = [self._clean_mentions(a.lower()) for a in args]
-        self.keywords.add_words(ctx.author.id, words)
-        words = self.keywords.get_words(ctx.author.id)
+        await self.keywords.add_words(ctx.author.id, words)
+        words = await self.keywords.get_words(ctx.author.id)
         await self._send(ctx, words)
 
     @notify.group(name='rem', aliases=['remove', 'del', 'delete'])
@@ -287,24 +901,22 @@ class Keywords(Cog):
         """Remove keywords from list."""
         log_command(ctx)
         words = [self._clean_mentions(a.lower()) for a in args]
-        self.keywords.remove_words(ctx.author.id, words)
-        words = self.keywords.get_words(ctx.author.id)
+        await self.keywords.remove_words(ctx.author.id, words)
+        words = await self.keywords.get_words(ctx.author.id)
         await self._send(ctx, words)
 
     @notify.group(name='clear')
     async def notify_clear(self, ctx: Context) -> None:
         """Remove all keywords."""
         log_command(ctx)
-        words = self.keywords.get_words(ctx.author.id)
-        self.keywords.remove_words(ctx.author.id, words)
-        words = self.keywords.get_words(ctx.author.id)
-        await self._send(ctx, words)
+        await self.keywords.remove_user(ctx.author.id)
+        await self._send(ctx, [])
 
     @notify.group(name='list', aliases=['all'])
     async def notify_list(self, ctx: Context) -> None:
         """List all keywords."""
         log_command(ctx)
-        words = self.keywords.get_words(ctx.author.id)
+        words = await self.keywords.get_words(ctx.author.id)
         await self._send(ctx, words)
 
     async def _send(self, ctx, words: list) -> None:
@@ -319,7 +931,7 @@ class Keywords(Cog):
         except Forbidden as err:
             if err.code == 50007:
                 await ctx.send(f"<@!{ctx.author.id}>, I couldn't send you a DM. Please go to 'Privacy Settings' for this server and allow direct messages from server members.")
-                print(f"Couldn't DM user {ctx.author.name}")
+                log.info(f"Couldn't DM user {ctx.author.name}", extra={'user': ctx.author.id})
 
 
 def setup(bot: Bot) -> None:
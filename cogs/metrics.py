@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+from aiohttp import web
+from discord.ext.commands import Bot, Cog, Context, command
+
+from .utils.logs import *
+from .utils.metrics import (COMMAND_SECONDS, DATABASE_SECONDS, LISTENER_SECONDS,
+                            LOOP_LAG_SECONDS, NOTIFICATIONS, REGISTRY, Gauge, render)
+
+
+class Metrics(Cog):
+    """
+    Runtime metrics, served in Prometheus text format on a local HTTP port
+    if one is configured, and summarised by an owner only command.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self.bot = bot
+        self.runner = None
+        self.tasks = [bot.loop.create_task(self._measure_lag())]
+        if bot.metrics.get('port'):
+            self.tasks.append(bot.loop.create_task(self._serve(bot.metrics['port'])))
+
+        # Time every command
+        bot.before_invoke(self._before_invoke)
+        bot.after_invoke(self._after_invoke)
+
+        # Read stats kept by the other cogs when exporting
+        self.gauges = [
+            Gauge('senko_cache_hits_total', 'Keyword cache hits', kind='counter',
+                  function=lambda: self._cache_stat('hits')),
+            Gauge('senko_cache_misses_total', 'Keyword cache misses', kind='counter',
+                  function=lambda: self._cache_stat('misses')),
+            Gauge('senko_cache_evictions_total', 'Keyword cache evictions', kind='counter',
+                  function=lambda: self._cache_stat('evictions')),
+            Gauge('senko_cache_guilds', 'Guilds in keyword cache',
+                  function=lambda: self._cache_stat('guilds')),
+            Gauge('senko_cache_users', 'Users in keyword cache',
+                  function=lambda: self._cache_stat('users')),
+            Gauge('senko_notification_queue', 'Notifications waiting to be sent',
+                  function=lambda: self._notify_stat('queued')),
+            Gauge('senko_write_behind_pending', 'Membership changes waiting to be written',
+                  function=lambda: self._writes_stat('pending')),
+            Gauge('senko_write_behind_lag_seconds', 'How long the oldest unwritten change has waited',
+                  function=lambda: self._writes_stat('lag')),
+            Gauge('senko_random_requests_total', 'Requests to random.org', kind='counter',
+                  function=lambda: self._dice_stat('requests')),
+            Gauge('senko_random_bits', 'Random bits left in the dice pool',
+                  function=lambda: self._dice_stat('bits left')),
+            Gauge('senko_gateway_latency_seconds', 'Heartbeat latency of each shard', ('shard',),
+                  function=self._latencies),
+            Gauge('senko_guilds', 'Guilds on each shard', ('shard',),
+                  function=self._guilds),
+        ]
+
+    def cog_unload(self) -> None:
+        for gauge in self.gauges:
+            REGISTRY.remove(gauge)
+        for task in self.tasks:
+            task.cancel()
+        if self.runner is not None:
+            self.bot.loop.create_task(self.runner.cleanup())
+
+    def _cache_stat(self, name: str) -> dict:
+        cog = self.bot.get_cog('Keywords')
+        return {(): cog.keywords.cache.stats()[name]} if cog else {}
+
+    def _notify_stat(self, name: str) -> dict:
+        cog = self.bot.get_cog('Keywords')
+        return {(): cog.dispatcher.stats()[name]} if cog else {}
+
+    def _writes_stat(self, name: str) -> dict:
+        cog = self.bot.get_cog('Keywords')
+        return {(): cog.keywords.writes.stats()[name]} if cog else {}
+
+    def _dice_stat(self, name: str) -> dict:
+        cog = self.bot.get_cog('Dice')
+        return {(): cog.dice.stats()[name]} if cog else {}
+
+    def _latencies(self) -> dict:
+        # Only AutoShardedBot has latencies, a plain Bot is shard 0
+        if hasattr(self.bot, 'latencies'):
+            return dict(self.bot.latencies)
+        return {0: self.bot.latency}
+
+    def _guilds(self) -> dict:
+        counts = {}
+        for guild in self.bot.guilds:
+            counts[guild.shard_id] = counts.get(guild.shard_id, 0) + 1
+        return counts
+
+    async def _before_invoke(self, ctx: Context) -> None:
+        ctx.started = time.perf_counter()
+
+    async def _after_invoke(self, ctx: Context) -> None:
+        started = getattr(ctx, 'started', None)
+        if started is not None:
+            latency = time.perf_counter() - started
+            COMMAND_SECONDS.observe(latency, command=ctx.command.qualified_name)
+            log.debug(f'{ctx.command.qualified_name} took {latency * 1000:.1f} ms', extra={
+                'guild': ctx.guild and ctx.guild.id,
+                'channel': ctx.channel.id,
+                'user': ctx.author.id,
+                'command': ctx.command.qualified_name,
+                'latency': latency,
+            })
+
+    async def _measure_lag(self) -> None:
+        # Anything blocking the event loop makes this sleep run late
+        while True:
+            start = self.bot.loop.time()
+            await asyncio.sleep(1)
+            LOOP_LAG_SECONDS.observe(max(0, self.bot.loop.time() - start - 1))
+
+    async def _serve(self, port: int) -> None:
+        async def metrics(request: web.Request) -> web.Response:
+            return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.bot.metrics.get('host', '127.0.0.1'), port).start()
+
+    @command(hidden=True)
+    async def stats(self, ctx: Context) -> None:
+        """Show a summary of the metrics. Owner only."""
+        if ctx.author.id != self.bot.owner:
+            return
+        log_command(ctx)
+
+        lines = []
+        for title, histogram in (('Listeners', LISTENER_SECONDS), ('Commands', COMMAND_SECONDS),
+                                 ('Database', DATABASE_SECONDS)):
+            lines.append(f'{title} (count, mean ms, p99 ms)')
+            for key, (count, mean, p99) in sorted(histogram.summary().items()):
+                lines.append(f'  {key[0]}: {count}, {mean * 1000:.2f}, <{p99 * 1000:g}')
+
+        cog = self.bot.get_cog('Keywords')
+        if cog is not None:
+            stats = cog.keywords.cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            stats['hit ratio'] = f"{stats['hits'] / lookups if lookups else 0:.1%}"
+            lines.append('Cache')
+            lines.extend(f'  {k}: {v}' for k, v in stats.items())
+            lines.append('Notifications')
+            lines.extend(f'  {k}: {v}' for k, v in cog.dispatcher.stats().items())
+            lines.extend(f'  {k[0]}: {v}' for k, v in NOTIFICATIONS.values.items())
+            lines.append('Membership writes')
+            lines.extend(f'  {k}: {v}' for k, v in cog.keywords.writes.stats().items())
+
+        for key, (count, mean, p99) in LOOP_LAG_SECONDS.summary().items():
+            lines.append(f'Loop lag: mean {mean * 1000:.2f} ms, p99 <{p99 * 1000:g} ms')
+
+        output = '\n'.join(lines)
+        for i in range(0, len(output), 1990):
+            await ctx.send(f'```{output[i:i + 1990]}```')
+
+
+def setup(bot: Bot) -> None:
+    """Load cog into bot."""
+    bot.add_cog(Metrics(bot))
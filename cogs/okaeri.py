@@ -1,9 +1,8 @@
-import re
-
-from discord import Message
-from discord.ext.commands import Bot, Cog, command
+from discord.ext.commands import Bot, Cog, Context, command
 
 from .utils.logs import *
+from .utils.router import Envelope
+from .utils.triggers import EMPTY, reload
 
 
 class Okaeri(Cog):
@@ -11,22 +10,33 @@ class Okaeri(Cog):
 
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
-
-    @Cog.listener()
-    async def on_message(self, message: Message) -> None:
-        if message.author.id == self.bot.user.id:
-            return
-        elif message.guild and message.guild.id in self.bot.quiet['guilds']:
-            return
-        elif message.channel.id in self.bot.quiet['channels']:
+        # Answer everyone but ourselves, except where we've been told to
+        # be quiet
+        bot.router.add('okaeri', self.on_message, lambda m: not m.own and not m.quiet)
+
+    def cog_unload(self) -> None:
+        self.bot.router.remove('okaeri')
+
+    async def on_message(self, envelope: Envelope) -> None:
+        trigger = self.bot.triggers.get('okaeri', EMPTY).match(envelope.text)
+        if trigger is not None:
+            await trigger.send(envelope.message.channel)
+
+    @command(hidden=True)
+    async def triggers(self, ctx: Context) -> None:
+        """Reload triggers from config.yaml. Owner only."""
+        if ctx.author.id != self.bot.owner:
             return
+        log_command(ctx)
 
-        if re.search(r"\bi[‘’']?m back\b", message.content, re.I):
-            await message.channel.send("おかえりなのじゃ！")
-        elif re.search(r"\bgood morning\b", message.content, re.I):
-            await message.channel.send("おはようなのじゃ！")
-        elif re.search(r"\bgood ?night\b", message.content, re.I):
-            await message.channel.send("おやすみなのじゃ！")
+        # Keep the old triggers if the new ones don't load
+        try:
+            self.bot.triggers = reload()
+        except (OSError, ValueError) as err:
+            await ctx.send(f'Failed to reload triggers: {err}')
+            return
+        counts = ', '.join(f'{len(t.triggers)} {s}' for s, t in self.bot.triggers.items())
+        await ctx.send(f'Reloaded triggers: {counts}')
 
     # @command(aliases=['quiet'])
     # async def mute(self, ctx: Context, *args: str) -> None:
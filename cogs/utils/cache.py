@@ -1,11 +1,21 @@
+from collections import OrderedDict
+from types import MappingProxyType
+
+from .matcher import Matcher
+
+
 class User:
     def __init__(self, id: int, words: list) -> None:
-        self.id = id
-        self.words = set(words)
+        self.id = int(id)
+        # Words are never changed in place, only replaced, so the set can be
+        # handed out without copying.
+        self.words = frozenset(words)
+        # IDs of cached guilds the user is in
+        self.guilds = set()
 
-    def get_words(self) -> list:
+    def get_words(self) -> frozenset:
         # Get set of all words
-        return list(self.words)
+        return self.words
 
     def add_words(self, words: list) -> None:
         # Add new words to set if not present
@@ -16,11 +26,47 @@ class User:
         self.words = self.words.difference(words)
 
 
+class GuildView:
+    """
+    Read-only snapshot of a cached guild for checking messages.
+    A guild hands out the same snapshot until its users or keywords change,
+    so reading it for every message doesn't allocate anything.
+    """
+    __slots__ = ('id', 'users', 'matcher')
+
+    def __init__(self, guild: 'Guild') -> None:
+        self.id = guild.id
+        # Maps user ID to the user's frozenset of words
+        self.users = MappingProxyType({u.id: u.words for u in guild.get_users()})
+        self.matcher = guild.get_matcher()
+
+
 class Guild:
     def __init__(self, id: int) -> None:
         self.id = id
         self.users = {}
         self.usage = 0
+        # Inverted index mapping each casefolded keyword to the IDs of users
+        # who want it
+        self.index = {}
+        self.matcher = None
+        self.view = None
+
+    def get_view(self) -> GuildView:
+        # Take a new snapshot if the guild changed since the last message
+        if self.view is None:
+            self.view = GuildView(self)
+        return self.view
+
+    def get_matcher(self) -> Matcher:
+        # Compile the guild's keywords if they changed since the last message
+        if self.matcher is None:
+            self.matcher = Matcher(self.index)
+        return self.matcher
+
+    def get_subscribers(self, word: str) -> set:
+        # Get IDs of users in guild who have a keyword
+        return self.index.get(word.casefold(), set())
 
     def get_user(self, user_id: int) -> User:
         # Get a user from guild
@@ -32,105 +78,226 @@ class Guild:
 
     def add_user(self, user: User) -> None:
         # Add user to guild
+        self.remove_user(user.id)
         self.users[user.id] = user
+        self.add_words(user.id, user.words)
 
     def remove_user(self, user_id: int) -> None:
         # Remove user from guild
-        self.users.pop(user_id, None)
+        user = self.users.pop(user_id, None)
+        if user is not None:
+            self.remove_words(user_id, user.words)
+
+    def add_words(self, user_id: int, words: list) -> None:
+        # Add user to the index for each word. The matcher only needs
+        # recompiling if a word is new to the guild.
+        self.view = None
+        for word in words:
+            if not word:
+                continue
+            users = self.index.get(word.casefold())
+            if users is None:
+                self.index[word.casefold()] = {user_id}
+                self.matcher = None
+            else:
+                users.add(user_id)
+
+    def remove_words(self, user_id: int, words: list) -> None:
+        # Remove user from the index for each word. The matcher only needs
+        # recompiling if nobody in the guild has the word anymore.
+        self.view = None
+        for word in words:
+            users = self.index.get(word.casefold())
+            if users is None:
+                continue
+            users.discard(user_id)
+            if not users:
+                del self.index[word.casefold()]
+                self.matcher = None
 
 
 class Cache:
-    def __init__(self, capacity: int) -> None:
-        self.cache = {}
+    """
+    Cache of guilds and their users' keywords, holding at most capacity
+    guilds. When full, adding a guild evicts either the least frequently
+    used guild ('lfu', with usage halved at every eviction so old bursts of
+    activity fade) or the least recently used one ('lru').
+    """
+
+    def __init__(self, capacity: int, policy: str='lfu') -> None:
+        if policy not in ('lfu', 'lru'):
+            raise ValueError(f"Unknown cache policy '{policy}'")
+        # Guilds are kept in order of last use, least recent first
+        self.cache = OrderedDict()
+        # Every user in a cached guild, shared between guilds. A user is
+        # dropped once none of their guilds are cached.
+        self.users = {}
         self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def keys(self) -> list:
         # Return list of keys (guild IDs) in the cache.
         return self.cache.keys()
 
-    def get_guild(self, guild_id: int) -> dict:
-        # This is called by Database.get_words() when guild is cached.
-        # We want to update usage when cache gets called by Database.get_words()
-        # because that means we're checking a new message for keywords.
-        self.cache[guild_id].usage += 1
-
-        # Get from cache a dict mapping user_id to set of words.
-        # Database doesn't know about User and Guild objects.
-        userlist = {}
-        for user in self.cache[guild_id].get_users():
-            userlist[user.id] = user.get_words()
-        return userlist
-
-    def add_guild(self, guild_id: int, data: list) -> None:
-        # This is called by Database.get_words() when guild isn't cached.
-        # Add a guild to cache, replace LFU if capacity reached.
-        # Don't worry about capacity for now, we'll handle it later.
+    def peek(self, guild_id: int) -> Guild:
+        # Get a guild without counting it as a use
+        return self.cache.get(guild_id)
+
+    def stats(self) -> dict:
+        # Counters for sizing the cache
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'guilds': len(self.cache),
+            'users': len(self.users),
+            'capacity': self.capacity,
+            'policy': self.policy,
+        }
+
+    def get_guild(self, guild_id: int) -> GuildView:
+        # This is called by Database.get_guild() for every message, so this
+        # is where we count usage. Returns None if guild isn't cached.
+        guild = self.cache.get(guild_id)
+        if guild is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        guild.usage += 1
+        self.cache.move_to_end(guild_id)
+        return guild.get_view()
+
+    def add_guild(self, guild_id: int, data: list) -> Guild:
+        # This is called by Database.get_guild() when guild isn't cached.
+        # Add a guild to cache, evicting another if capacity reached.
+        self.remove_guild(guild_id)
+        while self.cache and len(self.cache) >= self.capacity:
+            self._evict()
         guild = Guild(guild_id)
-        user_ids = set([d['user'] for d in data])
+        guild.usage = 1
+        words = {}
+        for d in data:
+            words.setdefault(int(d['user']), []).append(d['word'])
 
         # The same user object is shared between guilds,
         # so we need to check if the user exists first.
         # If not, we make a new user to pass in.
-        for user_id in user_ids:
-            user = self._get_user(user_id)
+        for user_id, user_words in words.items():
+            user = self.users.get(user_id)
             if user is None:
-                words = [d['word'] for d in data if d['user'] == user_id]
-                user = User(user_id, words)
-            guild.add_user(user)  
+                user = User(user_id, user_words)
+            self._join(guild, user)
         self.cache[guild_id] = guild
+        return guild
+
+    def _evict(self) -> None:
+        # Users are only referenced by the guilds they're in, so a user stays
+        # cached as long as any other guild that has them stays cached.
+        if self.policy == 'lru':
+            victim = next(iter(self.cache.values()))
+        else:
+            # Ties go to the least recently used guild
+            victim = min(self.cache.values(), key=lambda g: g.usage)
+            for guild in self.cache.values():
+                guild.usage //= 2
+        self.remove_guild(victim.id)
+        self.evictions += 1
+
+    def clear(self) -> None:
+        # Drop every guild, e.g. when we can't tell what changed anymore
+        self.cache.clear()
+        self.users.clear()
 
     def remove_guild(self, guild_id: int) -> None:
         # This gets called if Senko leaves a guild
-        self.cache.pop(guild_id, None)
+        guild = self.cache.pop(guild_id, None)
+        if guild is not None:
+            for user in guild.get_users():
+                self._release(user, guild_id)
 
     def add_guild_member(self, guild_id: int, user_id: int) -> None:
         # This gets called if a new member joins a guild that Senko is in.
         # This only gets called if the user is already in cache.
-        if guild_id in self.cache.keys():
-            user = self._get_user(user_id)
-            if user is not None:
-                self.cache[guild_id].add_user(user)
+        guild = self.cache.get(guild_id)
+        user = self.users.get(user_id)
+        if guild is not None and user is not None:
+            self._join(guild, user)
 
     def remove_guild_member(self, guild_id: int, user_id: int) -> None:
         # This gets called if someone leaves a guild that Senko is in.
         # The ex-member may or may not be a user, database doesn't care.
         # Database also doesn't check if guild is in cache or not.
-        if guild_id in self.cache.keys():
-            self.cache[guild_id].remove_user(user_id)
+        guild = self.cache.get(guild_id)
+        if guild is not None:
+            self._leave(guild, user_id)
 
     def has_user(self, user_id: int) -> bool:
         # Check if a user is in cache
-        return (self._get_user(user_id) is not None)
+        return user_id in self.users
 
     def add_user(self, guild_ids: list, user_id: int, words: list) -> None:
         # Add a new user to cache. This is called when we add a new user to
         # the database or when user not in cache joins a cached guild.
-        user = User(user_id, words)
+        user = self.users.get(user_id)
+        if user is None:
+            user = User(user_id, words)
         for guild_id in guild_ids:
-            if guild_id in self.cache.keys():
-                self.cache[guild_id].add_user(user)
+            guild = self.cache.get(guild_id)
+            if guild is not None:
+                self._join(guild, user)
+
+    def remove_user(self, user_id: int) -> None:
+        # Remove a user from every cached guild, and so from cache
+        user = self.users.get(user_id)
+        if user is not None:
+            for guild in self._get_guilds(user):
+                self._leave(guild, user_id)
 
     def get_words(self, user_id: int) -> list:
         # Get a user's keyword list
-        user = self._get_user(user_id)
+        user = self.users.get(user_id)
         if user is not None:
             return user.get_words()
 
     def add_words(self, user_id: int, words: list) -> None:
         # Database should check if user is in cache, but we won't throw errors
         # if it didn't.
-        user = self._get_user(user_id)
+        user = self.users.get(user_id)
         if user is not None:
             user.add_words(words)
+            for guild in self._get_guilds(user):
+                guild.add_words(user.id, words)
 
     def remove_words(self, user_id: int, words: list) -> None:
         # Don't need to do anything if user doesn't exist
-        user = self._get_user(user_id)
+        user = self.users.get(user_id)
         if user is not None:
             user.remove_words(words)
+            for guild in self._get_guilds(user):
+                guild.remove_words(user.id, words)
+
+    def _join(self, guild: Guild, user: User) -> None:
+        # Add user to a cached guild and to the user registry
+        guild.add_user(user)
+        user.guilds.add(guild.id)
+        self.users[user.id] = user
+
+    def _leave(self, guild: Guild, user_id: int) -> None:
+        # Remove user from a cached guild
+        user = guild.get_user(user_id)
+        if user is not None:
+            guild.remove_user(user_id)
+            self._release(user, guild.id)
+
+    def _release(self, user: User, guild_id: int) -> None:
+        # Drop user from the registry once no cached guild has them
+        user.guilds.discard(guild_id)
+        if not user.guilds:
+            self.users.pop(user.id, None)
 
-    def _get_user(self, user_id: int) -> User:
-        for guild in self.cache.values():
-            user = guild.get_user(str(user_id))
-            if user is not None:
-                return user
+    def _get_guilds(self, user: User) -> list:
+        # Get every cached guild the user is in
+        return [self.cache[g] for g in user.guilds]
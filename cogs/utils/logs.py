@@ -1,11 +1,146 @@
 from discord.ext.commands import Context
+import copy
+import gzip
+import json
 import logging
+import os
+import queue
+import shutil
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+__all__ = ['log', 'log_command']
 
 log = logging.getLogger(__name__)
 
+# Context that log calls can pass in extra, written out as JSON fields
+FIELDS = ('guild', 'channel', 'user', 'command', 'latency')
+
+
+class RotatingHandler(RotatingFileHandler):
+    """
+    File handler that starts a new file when the current one gets bigger
+    than max_bytes or older than interval seconds, whichever comes first,
+    optionally gzipping the old ones.
+    """
+
+    def __init__(self, filename: str, max_bytes: int=0, interval: float=0,
+                 backups: int=7, compress: bool=False) -> None:
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+        if compress:
+            self.namer = lambda name: f'{name}.gz'
+            self.rotator = self._compress
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+    @staticmethod
+    def _compress(source: str, dest: str) -> None:
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any context fields the call passed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        exception = getattr(record, 'exception', None)
+        if exception:
+            entry['exception'] = exception
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain lines, with the traceback RecordHandler kept aside added back."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        exception = getattr(record, 'exception', None)
+        if exception:
+            text = f'{text}\n{exception}'
+        return text
+
+
+class RecordHandler(QueueHandler):
+    """
+    QueueHandler that keeps the traceback in record.exception instead of
+    folding it into the message, since prepare() drops exc_info before the
+    record crosses the queue.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+        elif record.exc_text:
+            record.exception = record.exc_text
+        record.exc_info = None
+        record.exc_text = None
+        return super().prepare(record)
+
+
+def setup(config: dict) -> QueueListener:
+    """
+    Send all logging through a queue to a background thread, which writes
+    to the console and a rotating log file, so logging never waits on the
+    disk. Returns the listener, stop() it on exit to flush the queue.
+    """
+    if config.get('json', False):
+        file_format = JsonFormatter()
+    else:
+        file_format = TextFormatter('[%(asctime)s] %(message)s')
+    file = RotatingHandler(
+        config.get('file', '../senko.log'),
+        max_bytes = config.get('max_bytes', 10 * 1024 * 1024),
+        interval = config.get('interval', 24 * 60 * 60),
+        backups = config.get('backups', 7),
+        compress = config.get('compress', True)
+    )
+    file.setLevel(config.get('level', 'DEBUG'))
+    file.setFormatter(file_format)
+
+    console = logging.StreamHandler()
+    console.setLevel(config.get('console_level', 'INFO'))
+    console.setFormatter(TextFormatter('[%(asctime)s] %(message)s'))
+
+    # The queue is unbounded, putting never blocks the event loop
+    records = queue.Queue()
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(RecordHandler(records))
+    listener = QueueListener(records, file, console, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
 def log_command(ctx: Context) -> None:
     if ctx.guild:
         channel = f'{ctx.guild}/{ctx.channel}'
     else:
         channel = 'DM'
-    log.warning(f'({channel}) <{ctx.author}> {ctx.message.content}')
+    log.warning(f'({channel}) <{ctx.author}> {ctx.message.content}', extra={
+        'guild': ctx.guild and ctx.guild.id,
+        'channel': ctx.channel.id,
+        'user': ctx.author.id,
+        'command': ctx.command and ctx.command.qualified_name,
+    })
@@ -0,0 +1,65 @@
+import re
+
+_WORD = re.compile(r'\w')
+
+
+def _is_boundary(text: str, i: int) -> bool:
+    # Same rule as \b: a word character on exactly one side of position i
+    before = i > 0 and _WORD.match(text[i-1]) is not None
+    after = i < len(text) and _WORD.match(text[i]) is not None
+    return before != after
+
+
+class Matcher:
+    """
+    All keywords of a guild compiled into a single regex.
+    A keyword matches with the same rules as searching for r'\bword\b'
+    case-insensitively, but the text only gets scanned once for everyone,
+    so the cost depends on the matches rather than the number of users.
+    Text has to be normalized with text.normalize() first.
+    """
+
+    def __init__(self, index: dict) -> None:
+        # Index maps each casefolded keyword to the users who want it. It's
+        # kept up to date by the guild, so changes to who wants a keyword
+        # don't need a recompile, only changes to the set of keywords do.
+        self.subscribers = index
+
+        # Longest keyword first, so at each position the regex picks the
+        # longest keyword that matches there. Any other keyword matching at
+        # the same position has to be a prefix of it, so remember those.
+        words = sorted(self.subscribers, key=len, reverse=True)
+        self.prefixes = {}
+        for word in words:
+            self.prefixes[word] = [word[:i] for i in range(len(word) - 1, 0, -1)
+                                   if word[:i] in self.subscribers]
+
+        # Zero width lookahead so every position gets tried, not just the
+        # ones after the previous match.
+        if words:
+            pattern = '|'.join(re.escape(w) for w in words)
+            self.regex = re.compile(r'(?=\b(' + pattern + r')\b)')
+        else:
+            self.regex = None
+
+    def search(self, text: str) -> list:
+        # Return every (user, keyword) pair found in text
+        return [(user_id, word)
+                for word in self.search_words(text)
+                for user_id in self.subscribers[word]]
+
+    def search_words(self, text: str) -> set:
+        # Return the set of keywords found in text
+        found = set()
+        if self.regex is None or not text:
+            return found
+        for match in self.regex.finditer(text):
+            word = match.group(1)
+            if not self.subscribers.get(word):
+                continue
+            found.add(word)
+            start = match.start()
+            for prefix in self.prefixes[word]:
+                if prefix not in found and _is_boundary(text, start + len(prefix)):
+                    found.add(prefix)
+        return found
@@ -0,0 +1,155 @@
+import functools
+import time
+from bisect import bisect_left
+
+# Every metric registers itself here to be exported
+REGISTRY = []
+
+# Upper bounds in seconds, from 0.1 ms to 10 s
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+class Metric:
+    """Base for metrics with optional labels, in Prometheus' data model."""
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: tuple=()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[l]) for l in self.labelnames)
+
+    def samples(self):
+        # Yield (suffix, labels, value) for every sample
+        return iter(())
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            if labels:
+                label = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{self.name}{suffix}{{{label}}} {value}')
+            else:
+                lines.append(f'{self.name}{suffix} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: tuple=()) -> None:
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield '', tuple(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    """
+    Value that gets read when exported, either set directly or from
+    function, which returns a number or a dict of label values to numbers.
+    kind can be 'counter' for counts kept elsewhere, e.g. Cache.hits.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: tuple=(), function=None, kind: str='gauge') -> None:
+        super().__init__(name, help, labelnames)
+        self.values = {}
+        self.function = function
+        self.kind = kind
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def samples(self):
+        values = self.values
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            if not isinstance(key, tuple):
+                key = (key,)
+            yield '', tuple(zip(self.labelnames, map(str, key))), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple=(), buckets: tuple=BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # Maps label values to [count per bucket..., count, sum]
+        self.values = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    def summary(self) -> dict:
+        # Map label values to (count, mean, approximate 99th percentile)
+        result = {}
+        for key, counts in self.values.items():
+            count, total = counts[-2], counts[-1]
+            seen, p99 = 0, float('inf')
+            for bound, n in zip(self.buckets, counts):
+                seen += n
+                if seen >= count * 0.99:
+                    p99 = bound
+                    break
+            result[key] = (count, total / count if count else 0, p99)
+        return result
+
+    def samples(self):
+        for key, counts in self.values.items():
+            labels = tuple(zip(self.labelnames, key))
+            seen = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                seen += n
+                yield '_bucket', labels + (('le', bound),), seen
+            yield '_count', labels, counts[-2]
+            yield '_sum', labels, counts[-1]
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator recording how long a coroutine function takes."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    # All metrics in Prometheus text format
+    return '\n'.join(m.render() for m in REGISTRY) + '\n'
+
+
+LISTENER_SECONDS = Histogram('senko_listener_seconds', 'Time spent in event listeners', ('listener',))
+COMMAND_SECONDS = Histogram('senko_command_seconds', 'Time spent running commands', ('command',))
+ROUTER_SECONDS = Histogram('senko_router_seconds', 'Time spent routing messages to handlers', ('stage',))
+DATABASE_SECONDS = Histogram('senko_database_seconds', 'Time spent in keyword database calls', ('method',))
+LOOP_LAG_SECONDS = Histogram('senko_loop_lag_seconds', 'How late the event loop runs a scheduled callback')
+NOTIFICATIONS = Counter('senko_notifications_total', 'Keyword notifications by result', ('result',))
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import deque
+
+from .logs import log
+from .metrics import NOTIFICATIONS
+
+
+class Dispatcher:
+    """
+    Queue of notifications sent by a fixed number of workers.
+    Listeners only have to queue a notification, and wait only if queue_size
+    notifications are already waiting. Sends to the same route (e.g. the
+    same user's DMs) are spaced out so we stay under Discord's per-route
+    rate limits. A notification whose route is busy waits on its own, so
+    workers only ever send and one busy route can't hold up the others.
+    """
+
+    def __init__(self, send, workers: int=4, queue_size: int=1000, route_rate: float=1.0) -> None:
+        # send is the coroutine function that actually sends a notification
+        self.send = send
+        self.workers = workers
+        self.interval = 1 / route_rate
+        # Notifications that can be sent right away
+        self.queue = asyncio.Queue()
+        # Maps route to notifications waiting for its next slot, and when
+        # the route can send next
+        self.waiting = {}
+        self.next_send = {}
+        self.timers = {}
+        self.space = asyncio.Semaphore(queue_size)
+        self.unsent = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.tasks = []
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.latency = deque(maxlen=1000)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
+
+    async def put(self, route, *args) -> None:
+        # Queue send(*args), waiting for space if too many are unsent
+        await self.space.acquire()
+        self.unsent += 1
+        self.idle.clear()
+        item = (time.monotonic(), args)
+        waiting = self.waiting.get(route)
+        if waiting is not None:
+            waiting.append(item)
+            return
+
+        now = time.monotonic()
+        slot = self.next_send.get(route, 0)
+        if slot <= now:
+            self._ready(route, item, now)
+        else:
+            self.waiting[route] = deque([item])
+            self._wait(route, slot - now)
+
+        # Forget routes that have been idle for a while
+        if len(self.next_send) > 10000:
+            self.next_send = {r: t for r, t in self.next_send.items() if t > now or r in self.waiting}
+
+    async def join(self) -> None:
+        # Wait until everything queued has been sent or has failed
+        await self.idle.wait()
+
+    def _ready(self, route, item: tuple, now: float) -> None:
+        # Take the route's slot and hand the notification to the workers
+        self.next_send[route] = now + self.interval
+        self.queue.put_nowait(item)
+
+    def _wait(self, route, delay: float) -> None:
+        loop = asyncio.get_event_loop()
+        self.timers[route] = loop.call_later(delay, self._release, route)
+
+    def _release(self, route) -> None:
+        # The route's slot came up, send its oldest waiting notification
+        del self.timers[route]
+        waiting = self.waiting[route]
+        self._ready(route, waiting.popleft(), time.monotonic())
+        if waiting:
+            self._wait(route, self.interval)
+        else:
+            del self.waiting[route]
+
+    async def _worker(self) -> None:
+        while True:
+            queued, args = await self.queue.get()
+            try:
+                await self.send(*args)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.failed += 1
+                NOTIFICATIONS.inc(result='error')
+                log.error(f'Failed to send notification: {err!r}')
+            finally:
+                self.latency.append(time.monotonic() - queued)
+                self.space.release()
+                self.unsent -= 1
+                if not self.unsent:
+                    self.idle.set()
+
+    def stats(self) -> dict:
+        # Queue depth, delivery counts and recent delivery latency in seconds
+        latency = sorted(self.latency)
+        def percentile(p):
+            return latency[min(len(latency) - 1, int(len(latency) * p))] if latency else 0
+        return {
+            'queued': self.unsent,
+            'sent': self.sent,
+            'failed': self.failed,
+            'latency p50': round(percentile(0.5), 3),
+            'latency p99': round(percentile(0.99), 3),
+        }
+
+
+class Coalescer:
+    """
+    Merges hits for the same user and channel that arrive within window
+    seconds into one notification, and drops hits on a keyword the user was
+    notified about less than cooldown seconds ago. Either is off when 0.
+    """
+
+    def __init__(self, window: float=0, cooldown: float=0) -> None:
+        self.window = window
+        self.cooldown = cooldown
+        # Maps (user, channel) to hits waiting for the window to close
+        self.pending = {}
+        # Maps (user, keyword) to when the user was last notified about it
+        self.last = {}
+
+    def allow(self, user_id: int, word: str) -> bool:
+        # Check the keyword isn't cooling down for this user, and start the
+        # cooldown if it isn't
+        if not self.cooldown:
+            return True
+        now = time.monotonic()
+        if now - self.last.get((user_id, word), -self.cooldown) < self.cooldown:
+            return False
+        self.last[(user_id, word)] = now
+
+        # Forget cooldowns that are over
+        if len(self.last) > 10000:
+            self.last = {k: t for k, t in self.last.items() if now - t < self.cooldown}
+        return True
+
+    def add(self, key: tuple, hit: tuple) -> bool:
+        # Add a hit to its window. Returns True if this opened a new window,
+        # which the caller needs to flush once it closes.
+        hits = self.pending.get(key)
+        if hits is None:
+            self.pending[key] = [hit]
+            return True
+        hits.append(hit)
+        return False
+
+    def pop(self, key: tuple) -> list:
+        # Close a window and get all of its hits
+        return self.pending.pop(key, [])
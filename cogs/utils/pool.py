@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql.cursors
+
+
+class Pool:
+    """
+    Bounded pool of MySQL connections for use from the event loop.
+    Queries run on a dedicated thread pool, each thread with its own
+    connection, so a slow query never blocks the bot.
+    """
+
+    def __init__(self, db: dict, size: int=4) -> None:
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.conns = []
+
+    def _connect(self) -> pymysql.connections.Connection:
+        return pymysql.connect(
+            unix_socket = self.db['socket'],
+            user = self.db['user'],
+            password = self.db['password'],
+            db = self.db['database'],
+            charset = 'utf8mb4',
+            cursorclass = pymysql.cursors.DictCursor
+        )
+
+    def _get_conn(self) -> pymysql.connections.Connection:
+        # Get this thread's connection, connecting if we don't have one
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+            with self.lock:
+                self.conns.append(conn)
+        return conn
+
+    def _drop_conn(self) -> None:
+        # Throw away this thread's connection so the next call reconnects
+        conn = self.local.conn
+        self.local.conn = None
+        with self.lock:
+            self.conns.remove(conn)
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+    def _run(self, func, *args, cursorclass=None):
+        # Call func(cursor, *args) in a transaction on this thread. If the
+        # connection was lost (e.g. MySQL restarted or timed it out), reconnect
+        # and try once more.
+        for attempt in range(2):
+            conn = self._get_conn()
+            try:
+                with conn.cursor(cursorclass) as cursor:
+                    result = func(cursor, *args)
+                conn.commit()
+                return result
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                self._drop_conn()
+                if attempt:
+                    raise
+            except Exception:
+                conn.rollback()
+                raise
+
+    async def run(self, func, *args, cursorclass=None):
+        # Run func(cursor, *args) in the pool without blocking the event loop.
+        # cursorclass overrides the default DictCursor, e.g. SSDictCursor to
+        # stream a large result instead of buffering all of it.
+        loop = asyncio.get_event_loop()
+        run = functools.partial(self._run, func, *args, cursorclass=cursorclass)
+        return await loop.run_in_executor(self.executor, run)
+
+    def run_now(self, func, *args):
+        # Run func(cursor, *args) on the calling thread, blocking it. Only
+        # for shutdown, when the event loop may not run again.
+        return self._run(func, *args)
+
+    async def fetchall(self, query: str, args: tuple=()) -> list:
+        def fetchall(cursor):
+            cursor.execute(query, args)
+            return cursor.fetchall()
+        return await self.run(fetchall)
+
+    async def fetchone(self, query: str, args: tuple=()) -> dict:
+        def fetchone(cursor):
+            cursor.execute(query, args)
+            return cursor.fetchone()
+        return await self.run(fetchone)
+
+    async def execute(self, query: str, args: tuple=()) -> int:
+        def execute(cursor):
+            return cursor.execute(query, args)
+        return await self.run(execute)
+
+    async def executemany(self, query: str, rows: list) -> int:
+        # Inserts get sent as a single multi-row statement
+        def executemany(cursor):
+            return cursor.executemany(query, rows)
+        return await self.run(executemany)
+
+    def close(self) -> None:
+        # Wait for running queries to finish, then close all connections
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            for conn in self.conns:
+                try:
+                    conn.close()
+                except pymysql.err.Error:
+                    pass
+            self.conns.clear()
@@ -0,0 +1,95 @@
+import time
+
+from discord import Message
+
+from .logs import log
+from .metrics import LISTENER_SECONDS, ROUTER_SECONDS
+from .text import Bundle
+
+
+class Envelope:
+    """
+    A message with everything handlers filter on worked out once, and its
+    normalized text built the first time a handler asks for it.
+    """
+    __slots__ = ('message', 'dm', 'own', 'from_bot', 'quiet', 'dt', '_bundle')
+
+    def __init__(self, message: Message, bot) -> None:
+        self.message = message
+        self.dm = message.guild is None
+        self.own = message.author.id == bot.user.id
+        self.from_bot = message.author.bot
+        self.quiet = (message.channel.id in bot.quiet['channels']
+                      or (not self.dm and message.guild.id in bot.quiet['guilds']))
+        self.dt = message.channel.id in bot.dt
+        self._bundle = None
+
+    @property
+    def bundle(self) -> Bundle:
+        if self._bundle is None:
+            start = time.perf_counter()
+            self._bundle = Bundle(self.message)
+            ROUTER_SECONDS.observe(time.perf_counter() - start, stage='normalize')
+        return self._bundle
+
+    @property
+    def text(self) -> str:
+        # Normalized message content, without embeds
+        return self.bundle.content
+
+
+class Router:
+    """
+    Single on_message listener for the cogs. Each message is classified
+    once, then passed to the handlers whose filter accepts it, one after
+    another by priority, then name. That's cheaper than a task per
+    listener, but a handler waits for the ones before it, so handlers
+    that may wait on the database or network should go last.
+    """
+
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        # Maps name to (priority, filter, handler)
+        self.handlers = {}
+        # (name, filter, handler) in the order they run
+        self.order = []
+
+    def add(self, name: str, handler, accept=lambda envelope: True, priority: int=0) -> None:
+        # handler is a coroutine function taking an Envelope, accept a
+        # function taking the same Envelope and returning if it applies.
+        # Lower priorities run first.
+        self.handlers[name] = (priority, accept, handler)
+        self._sort()
+
+    def remove(self, name: str) -> None:
+        self.handlers.pop(name, None)
+        self._sort()
+
+    def _sort(self) -> None:
+        # Cogs load in whatever order the file system lists them, so don't
+        # depend on the order of registration
+        ordered = sorted(self.handlers.items(), key=lambda item: (item[1][0], item[0]))
+        self.order = [(name, accept, handler) for name, (_, accept, handler) in ordered]
+
+    async def dispatch(self, message: Message) -> None:
+        start = time.perf_counter()
+        envelope = Envelope(message, self.bot)
+        targets = [(n, h) for n, accept, h in self.order if accept(envelope)]
+        ROUTER_SECONDS.observe(time.perf_counter() - start, stage='classify')
+
+        for name, handler in targets:
+            await self._run(name, handler, envelope)
+
+    async def _run(self, name: str, handler, envelope: Envelope) -> None:
+        # A failing handler mustn't stop the others, report it like
+        # discord.py does for listeners
+        start = time.perf_counter()
+        try:
+            await handler(envelope)
+        except Exception:
+            log.exception(f'Ignoring exception in message handler {name}', extra={
+                'guild': envelope.message.guild and envelope.message.guild.id,
+                'channel': envelope.message.channel.id,
+            })
+        finally:
+            LISTENER_SECONDS.observe(time.perf_counter() - start, listener=name)
@@ -0,0 +1,32 @@
+import os
+
+
+def settings(config: dict, environ: dict=os.environ) -> dict:
+    """
+    Work out this process's shards from config.yaml and the environment
+    supervisor.py sets for each process it runs. Returns the shard count
+    and IDs (None if not sharded, or running all of them), and the metrics
+    and database settings adjusted for those shards.
+    Raises ValueError if the settings can't work together.
+    """
+    shards = config.get('shards', {})
+    count = shards.get('count')
+    ids = environ.get('SENKO_SHARD_IDS', shards.get('ids'))
+    if isinstance(ids, str):
+        ids = [int(i) for i in ids.split(',')]
+
+    metrics = dict(config.get('metrics', {}))
+    if 'SENKO_METRICS_PORT' in environ:
+        metrics['port'] = int(environ['SENKO_METRICS_PORT'])
+
+    # Processes with different shards cache different guilds
+    db = dict(config['database'])
+    if ids and db.get('snapshot'):
+        db['snapshot'] += '.' + '-'.join(map(str, ids))
+
+    # Other processes run the other shards, and only hear about keyword
+    # changes made in this one through the journal
+    if ids and not db.get('journal', False) and set(ids) != set(range(count or 0)):
+        raise ValueError('Running only some of the shards needs journal: true under database in config.yaml')
+
+    return {'count': count, 'ids': ids, 'metrics': metrics, 'db': db}
@@ -0,0 +1,114 @@
+import mmap
+import os
+import struct
+import zlib
+
+from .cache import Cache
+
+# Snapshot file layout, all little-endian:
+#   header: magic, version, CRC-32 of the body, body length
+#   users:  count, then per user: ID, word count, then per word: length, UTF-8
+#   guilds: count, then per guild: ID, usage, user count, then user positions
+MAGIC = b'SNKO'
+VERSION = 1
+HEADER = struct.Struct('<4sHIQ')
+COUNT = struct.Struct('<I')
+USER = struct.Struct('<QH')
+WORD = struct.Struct('<H')
+GUILD = struct.Struct('<QII')
+
+
+def checksum(pairs) -> tuple:
+    """
+    Row count and order-independent checksum of a guild's (user, word)
+    rows. Matches COUNT(*) and SUM(CRC32(CONCAT(user, ':', word))) in MySQL.
+    """
+    count = total = 0
+    for user, word in pairs:
+        count += 1
+        total += zlib.crc32(f'{user}:{word}'.encode())
+    return count, total
+
+
+def dump(cache: Cache) -> bytes:
+    # Serialise every cached guild. Users shared between guilds are stored
+    # once and referred to by position.
+    users = list(cache.users.values())
+    position = {u.id: i for i, u in enumerate(users)}
+
+    body = [COUNT.pack(len(users))]
+    for user in users:
+        words = [w.encode() for w in user.words]
+        body.append(USER.pack(user.id, len(words)))
+        for word in words:
+            body.append(WORD.pack(len(word)))
+            body.append(word)
+
+    body.append(COUNT.pack(len(cache.cache)))
+    for guild in cache.cache.values():
+        body.append(GUILD.pack(guild.id, min(guild.usage, 0xFFFFFFFF), len(guild.users)))
+        body.append(struct.pack(f'<{len(guild.users)}I', *(position[u] for u in guild.users)))
+
+    body = b''.join(body)
+    return HEADER.pack(MAGIC, VERSION, zlib.crc32(body), len(body)) + body
+
+
+def save(data: bytes, path: str) -> None:
+    # Write to a temporary file first so a crash never leaves half a snapshot
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def load(path: str) -> dict:
+    """
+    Read a snapshot into {guild ID: (usage, {user ID: frozenset of words})}.
+    Raises OSError if the file can't be read and ValueError if it's corrupt
+    or from another version.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError('Snapshot is truncated')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, crc, length = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'Not a version {VERSION} snapshot')
+            if len(data) != HEADER.size + length:
+                raise ValueError('Snapshot is truncated')
+            with memoryview(data)[HEADER.size:] as body:
+                if zlib.crc32(body) != crc:
+                    raise ValueError('Snapshot checksum mismatch')
+            try:
+                return _parse(data, HEADER.size)
+            except (struct.error, IndexError, UnicodeDecodeError) as err:
+                raise ValueError(f'Snapshot is malformed: {err}')
+
+
+def _parse(data: mmap.mmap, offset: int) -> dict:
+    users = []
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for _ in range(count):
+        user_id, word_count = USER.unpack_from(data, offset)
+        offset += USER.size
+        words = []
+        for _ in range(word_count):
+            (length,) = WORD.unpack_from(data, offset)
+            offset += WORD.size
+            words.append(data[offset:offset + length].decode())
+            offset += length
+        users.append((user_id, frozenset(words)))
+
+    guilds = {}
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for _ in range(count):
+        guild_id, usage, user_count = GUILD.unpack_from(data, offset)
+        offset += GUILD.size
+        positions = struct.unpack_from(f'<{user_count}I', data, offset)
+        offset += 4 * user_count
+        guilds[guild_id] = (usage, dict(users[p] for p in positions))
+    return guilds
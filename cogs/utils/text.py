@@ -0,0 +1,79 @@
+import re
+
+from discord import Message
+
+_MENTION = re.compile(r"<@[!&]?([\d]+)>")
+
+# Limits for messages from bots and webhooks, which can carry huge embeds
+MAX_EMBEDS = 5
+MAX_FIELDS = 10
+MAX_CHARS = 4000
+
+
+def normalize(text: str) -> str:
+    # Remove the ! or & in mentions and casefold, so matching is a plain
+    # case-sensitive search
+    if not text:
+        return ""
+    return _MENTION.sub(r"<@\1>", text).casefold()
+
+
+class Fragment:
+    """One searchable part of a message."""
+    __slots__ = ('source', 'quote', 'text')
+
+    def __init__(self, source: str, quote: str, text: str) -> None:
+        # Where the text came from, e.g. 'content' or 'embed 0 field 1 name'
+        self.source = source
+        # Original text to quote in notifications
+        self.quote = quote
+        # Normalized text to search
+        self.text = text
+
+
+class Bundle:
+    """
+    Every searchable part of a message, normalized once and shared by
+    everything that checks the message: the content first, then the
+    description, title and fields of each embed.
+    """
+    __slots__ = ('fragments',)
+
+    def __init__(self, message: Message) -> None:
+        self.fragments = []
+        if message.content:
+            self._add('content', message.clean_content, message.content)
+
+        # Bots and webhooks get a budget so one giant embed can't stall us
+        capped = message.author.bot or message.webhook_id is not None
+        budget = MAX_CHARS if capped else None
+        embeds = message.embeds[:MAX_EMBEDS] if capped else message.embeds
+        for i, embed in enumerate(embeds):
+            parts = [('description', embed.description), ('title', embed.title)]
+            if embed.fields is not embed.Empty:
+                fields = embed.fields[:MAX_FIELDS] if capped else embed.fields
+                for j, field in enumerate(fields):
+                    parts.append((f'field {j} name', field.name))
+                    parts.append((f'field {j} value', field.value))
+
+            for name, text in parts:
+                if not text:
+                    continue
+                if budget is not None:
+                    if budget <= 0:
+                        return
+                    text = text[:budget]
+                    budget -= len(text)
+                self._add(f'embed {i} {name}', text, text)
+
+    @property
+    def content(self) -> str:
+        # Normalized message content, always the first part if there is any
+        if self.fragments and self.fragments[0].source == 'content':
+            return self.fragments[0].text
+        return ""
+
+    def _add(self, source: str, quote: str, text: str) -> None:
+        text = normalize(text)
+        if text:
+            self.fragments.append(Fragment(source, quote, text))
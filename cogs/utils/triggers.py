@@ -0,0 +1,120 @@
+import io
+import os
+import re
+
+import yaml
+from discord import File
+
+# Used when config.yaml has no triggers section. Patterns are matched
+# against casefolded messages, see text.normalize(), so they ignore case.
+DEFAULTS = {
+    'okaeri': [
+        {'pattern': r"\bi[‘’']?m back\b", 'reply': "おかえりなのじゃ！"},
+        {'pattern': r"\bgood morning\b", 'reply': "おはようなのじゃ！"},
+        {'pattern': r"\bgood ?night\b", 'reply': "おやすみなのじゃ！"},
+    ],
+    'dt': [
+        {'pattern': r"(^|\W)dumb bran($|\W)", 'image': 'images/dumb_bran.png'},
+        {'pattern': r"(^|\W)boi($|\W)", 'image': 'images/boi.jpg'},
+    ],
+}
+
+# Numbered backreferences and conditionals, which would point at the wrong
+# group once patterns are combined. May also catch e.g. an escaped
+# backslash followed by a digit, that just costs a separate check.
+NUMBERED = re.compile(r'\\[1-9]|\(\?\(\d')
+
+# What every pattern gets compiled with
+FLAGS = re.compile('', re.IGNORECASE).flags
+
+
+class Trigger:
+    """A pattern and what to send when a message matches it."""
+    __slots__ = ('pattern', 'reply', 'filename', 'image', 'combinable')
+
+    def __init__(self, pattern: str, reply: str=None, image: str=None) -> None:
+        if reply is None and image is None:
+            raise ValueError(f"Trigger '{pattern}' needs a reply or an image")
+        # Messages get casefolded, so "I'm back" should still match them
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        # Inline flags like (?s) would apply to the whole combined pattern
+        self.combinable = self.pattern.flags == FLAGS and not NUMBERED.search(pattern)
+        self.reply = reply
+        # Images are read once here, sending them doesn't touch the disk
+        self.filename = None
+        self.image = None
+        if image is not None:
+            self.filename = os.path.basename(image)
+            with open(image, 'rb') as f:
+                self.image = f.read()
+
+    async def send(self, channel) -> None:
+        # discord.py closes the file after sending, so wrap the bytes anew
+        file = None
+        if self.image is not None:
+            file = File(io.BytesIO(self.image), filename=self.filename)
+        await channel.send(self.reply, file=file)
+
+
+class Triggers:
+    """
+    Triggers of one scope, compiled into a single pattern so a message
+    that matches none of them is scanned once however many there are.
+    Triggers whose pattern can't be combined with others are checked on
+    their own. When several match, the first in the table wins.
+    """
+
+    def __init__(self, triggers: list) -> None:
+        self.triggers = triggers
+        # Checked for every message, even if the combined pattern misses
+        self.separate = [t for t in triggers if not t.combinable]
+        combined = [t for t in triggers if t.combinable]
+        self.pattern = None
+        if combined:
+            try:
+                self.pattern = re.compile('|'.join(f'(?:{t.pattern.pattern})' for t in combined), FLAGS)
+            except re.error:
+                # e.g. two triggers with a group of the same name
+                self.separate = triggers
+
+    def match(self, text: str) -> Trigger:
+        # Only messages that hit something get checked trigger by trigger
+        candidates = self.triggers
+        if self.pattern is not None and not self.pattern.search(text):
+            candidates = self.separate
+        for trigger in candidates:
+            if trigger.pattern.search(text):
+                return trigger
+
+
+# For scopes missing from the config
+EMPTY = Triggers([])
+
+
+def load(config: dict=None) -> dict:
+    """
+    Build {scope: Triggers} from the triggers section of config.yaml, which
+    maps each scope to a list of pattern with reply and/or image.
+    Raises ValueError or OSError if a trigger is invalid.
+    """
+    if config is None:
+        config = DEFAULTS
+    tables = {}
+    for scope, entries in config.items():
+        try:
+            tables[scope] = Triggers([Trigger(**entry) for entry in entries or ()])
+        except (TypeError, re.error) as err:
+            raise ValueError(f"Bad trigger in '{scope}': {err}")
+    return tables
+
+
+def reload(path: str='config.yaml') -> dict:
+    # Read the triggers section from the config file again
+    with open(path) as stream:
+        try:
+            config = yaml.safe_load(stream)
+        except yaml.YAMLError as err:
+            raise ValueError(f'Bad config file: {err}')
+    if not isinstance(config, dict):
+        raise ValueError('Bad config file: not a mapping')
+    return load(config.get('triggers'))
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+from discord import Guild, Member, TextChannel
+
+
+class Visibility:
+    """
+    Cache of the IDs of members who can read each channel.
+    Getting channel.members checks permissions for every member in the guild,
+    so keep the result until something changes who can see the channel.
+    """
+
+    def __init__(self, capacity: int=100) -> None:
+        # Channels are kept in order of last use, least recent first
+        self.channels = OrderedDict()
+        self.capacity = capacity
+
+    def get_members(self, channel: TextChannel) -> set:
+        # Get IDs of members who can read channel
+        members = self.channels.get(channel.id)
+        if members is None:
+            members = set(m.id for m in channel.members)
+            self.channels[channel.id] = members
+            if len(self.channels) > self.capacity:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(channel.id)
+        return members
+
+    def update_member(self, member: Member) -> None:
+        # Member joined or their roles changed, recheck only them
+        for channel in member.guild.text_channels:
+            members = self.channels.get(channel.id)
+            if members is None:
+                continue
+            if channel.permissions_for(member).read_messages:
+                members.add(member.id)
+            else:
+                members.discard(member.id)
+
+    def remove_member(self, member: Member) -> None:
+        # Member left the guild
+        for channel in member.guild.text_channels:
+            members = self.channels.get(channel.id)
+            if members is not None:
+                members.discard(member.id)
+
+    def remove_channel(self, channel_id: int) -> None:
+        # Channel permissions changed, recheck everyone next time
+        self.channels.pop(channel_id, None)
+
+    def remove_guild(self, guild: Guild) -> None:
+        # Role permissions changed, recheck every channel next time
+        for channel in guild.text_channels:
+            self.channels.pop(channel.id, None)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from .logs import log
+from .metrics import DATABASE_SECONDS
+
+
+class WriteBehind:
+    """
+    Buffer of database changes that have already been applied to the cache,
+    written in one transaction once max_pending changes are waiting or the
+    oldest has waited interval seconds.
+
+    Changes are keyed, and a change replaces any pending one with the same
+    key, so e.g. a member joining and leaving again before a flush costs a
+    single statement. write(cursor, changes) gets the (key, value) pairs in
+    the order they were last changed and must apply them all.
+
+    Crash safety: a change is only durable once flushed. If the process is
+    killed, up to interval seconds (or max_pending changes) of changes are
+    lost; a clean shutdown flushes everything first. A flush that fails
+    keeps its changes and retries them with the next one, so losing the
+    database for a while delays writes but doesn't drop them.
+    """
+
+    def __init__(self, pool, write, max_pending: int=500, interval: float=1.0) -> None:
+        self.pool = pool
+        self.write = write
+        self.max_pending = max_pending
+        self.interval = interval
+        # Maps key to (value, time first queued), oldest first
+        self.pending = OrderedDict()
+        # Batches taken by flushes that haven't finished yet, oldest first,
+        # and the number of flushes finished, whether they wrote or not
+        self.flushing = []
+        self.settled = 0
+        self.full = asyncio.Event()
+        self.task = None
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.task = loop.create_task(self._run())
+
+    def stop(self) -> None:
+        # Write out whatever is left. The loop may not run again, so this
+        # blocks until it's written.
+        if self.task is not None:
+            self.task.cancel()
+        changes = [(k, v) for k, (v, _) in self._take().items()]
+        if changes:
+            self.pool.run_now(self.write, changes)
+            self.written += len(changes)
+
+    def put(self, key, value) -> None:
+        queued = time.monotonic()
+        if key in self.pending:
+            # Keep the original time so lag covers the whole wait
+            queued = self.pending.pop(key)[1]
+            self.coalesced += 1
+        self.pending[key] = (value, queued)
+        if len(self.pending) >= self.max_pending:
+            self.full.set()
+
+    def find(self, match) -> list:
+        # Unwritten (key, value) pairs whose key match(key) accepts, for
+        # reading the database as if they were already written. Batches
+        # being flushed count until they're committed, newer changes win.
+        found = {}
+        for batch in (*self.flushing, self.pending):
+            for key, (value, _) in batch.items():
+                if match(key):
+                    found[key] = value
+        return list(found.items())
+
+    def discard(self, match) -> None:
+        # Drop pending changes whose key match(key) accepts, e.g. changes
+        # to members of a guild that's about to be deleted anyway
+        for key in [k for k in self.pending if match(k)]:
+            del self.pending[key]
+            self.coalesced += 1
+
+    def lag(self) -> float:
+        # Seconds the oldest pending change has been waiting
+        if not self.pending:
+            return 0
+        return time.monotonic() - next(iter(self.pending.values()))[1]
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self.pending),
+            'lag': self.lag(),
+            'flushes': self.flushes,
+            'written': self.written,
+            'coalesced': self.coalesced,
+        }
+
+    def _take(self) -> OrderedDict:
+        taken, self.pending = self.pending, OrderedDict()
+        self.full.clear()
+        return taken
+
+    async def flush(self) -> None:
+        taken = self._take()
+        if not taken:
+            return
+        changes = [(k, v) for k, (v, _) in taken.items()]
+        self.flushing.append(taken)
+        start = time.perf_counter()
+        try:
+            await self.pool.run(self.write, changes)
+        except Exception as err:
+            # Put the changes back in front of anything newer, unless the
+            # same key changed again in the meantime
+            log.error(f'Failed to write {len(changes)} changes, will retry: {err!r}')
+            for key in self.pending:
+                taken.pop(key, None)
+            taken.update(self.pending)
+            self.pending = taken
+            if len(self.pending) >= self.max_pending:
+                self.full.set()
+            raise
+        finally:
+            self.flushing = [batch for batch in self.flushing if batch is not taken]
+            self.settled += 1
+            DATABASE_SECONDS.observe(time.perf_counter() - start, method='flush')
+        self.flushes += 1
+        self.written += len(changes)
+
+    async def _run(self) -> None:
+        while True:
+            # Wake up when enough changes are waiting, or the oldest one has
+            # waited long enough
+            timeout = max(self.interval - self.lag(), 0) if self.pending else self.interval
+            try:
+                await asyncio.wait_for(self.full.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self.pending and (self.full.is_set() or self.lag() >= self.interval):
+                try:
+                    await self.flush()
+                except Exception:
+                    # Already logged, back off before retrying
+                    await asyncio.sleep(self.interval)
@@ -0,0 +1,19 @@
+-- Journal of keyword and guild membership changes, read by every bot
+-- process sharing the database to keep its cache up to date.
+-- Enable with `journal: true` under `database` in config.yaml.
+CREATE TABLE IF NOT EXISTS `journal` (
+    `version` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `created` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    `origin` CHAR(32) NOT NULL,
+    `action` ENUM('add_word', 'remove_word', 'add_member', 'remove_member', 'remove_guild', 'remove_user', 'add_user') NOT NULL,
+    `guild` BIGINT UNSIGNED NULL,
+    `user` BIGINT UNSIGNED NULL,
+    `word` VARCHAR(255) NULL,
+    PRIMARY KEY (`version`),
+    KEY `created` (`created`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Journals created before remove_user and add_user existed need them added
+-- to the enum, or writing them fails in strict mode. Safe to run again.
+ALTER TABLE `journal` MODIFY `action`
+    ENUM('add_word', 'remove_word', 'add_member', 'remove_member', 'remove_guild', 'remove_user', 'add_user') NOT NULL;
@@ -1,40 +1,55 @@
 #!/usr/bin/env python3
 import os
 import logging
+import sys
 
 import yaml
-from discord.ext.commands import Bot, Context, CommandError, CommandOnCooldown
-
-# create logger
-log = logging.getLogger(__package__)
-log.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('../senko.log')
-fh.setLevel(logging.DEBUG)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.WARNING)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('[%(asctime)s] %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-# add the handlers to the logger
-log.addHandler(fh)
-log.addHandler(ch)
+from discord.ext.commands import AutoShardedBot, Bot, Context, CommandError, CommandOnCooldown
 
+from cogs.utils import logs, shards, triggers
+from cogs.utils.router import Router
 
 # Import config file
 with open('config.yaml') as stream:
     config = yaml.safe_load(stream)
 
+# Log through a queue so writing to disk happens in a background thread
+log = logging.getLogger(__package__)
+listener = logs.setup(config.get('logging', {}))
+
+# Sharding is optional. supervisor.py runs one process per group of shards
+# and tells each which shards it has and where to serve metrics.
+try:
+    sharding = shards.settings(config)
+except ValueError as err:
+    log.critical(err)
+    listener.stop()
+    sys.exit(1)
+
 # Initialise bot
-bot = Bot(command_prefix=config['prefix'])
+if sharding['count']:
+    bot = AutoShardedBot(command_prefix=config['prefix'], shard_count=sharding['count'],
+                         shard_ids=sharding['ids'])
+else:
+    bot = Bot(command_prefix=config['prefix'])
 bot.remove_command('help')
 bot.owner = config['owner']
 bot.keys = config['keys']
-bot.db = config['database']
-bot.quiet = config['quiet']
-bot.dt = config['dt_channels']
+bot.db = sharding['db']
+# Checked for every message, so make membership tests constant time
+bot.quiet = {
+    'guilds': frozenset(config['quiet'].get('guilds') or ()),
+    'channels': frozenset(config['quiet'].get('channels') or ()),
+}
+bot.dt = frozenset(config['dt_channels'] or ())
+bot.triggers = triggers.load(config.get('triggers'))
+bot.notify = config.get('notify', {})
+bot.random_url = config.get('random_url')
+bot.metrics = sharding['metrics']
+
+# Every cog's message handling goes through one listener
+bot.router = Router(bot)
+bot.add_listener(bot.router.dispatch, 'on_message')
 
 # Load cogs
 for file in filter(lambda file: file.endswith('.py'), os.listdir('./cogs')):
@@ -47,6 +62,8 @@ async def on_ready() -> None:
     for guild in bot.guilds:
         log.warning(f'{guild.name} ({guild.id})')
     log.warning(f'({len(bot.guilds)} servers)')
+    if bot.shard_count:
+        log.warning(f'Shards {bot.shard_ids or "all"} of {bot.shard_count}')
     log.warning('************************')
 
 # Handle command cooldown
@@ -55,5 +72,8 @@ async def on_command_error(ctx: Context, error: CommandError) -> None:
     if isinstance(error, CommandOnCooldown):
         await ctx.send(error)
 
-# Start bot
-bot.run(config['token'])
\ No newline at end of file
+# Start bot, then write out whatever is still queued to be logged
+try:
+    bot.run(config['token'])
+finally:
+    listener.stop()
\ No newline at end of file
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Run Senko as several processes, each connected to its own group of shards.
+
+Reads `shards` from config.yaml: `count` shards are split evenly between
+`processes` copies of senko.py, which needs `database.journal` on so they
+see each other's keyword changes. Processes that exit get restarted. If
+`metrics.port` is set, the supervisor serves there:
+  /metrics  every process's metrics, labelled with its process number
+  /health   whether every process is running and answering, as JSON
+and each process serves its own metrics on the ports after it.
+
+Usage: python3 supervisor.py [script [args...]]
+script defaults to senko.py, anything else gets run in its place with the
+given arguments, e.g. benchmarks/fake_shard.py for trying this out without
+connecting to Discord.
+"""
+import asyncio
+import json
+import os
+import re
+import signal
+import sys
+
+import aiohttp
+import yaml
+from aiohttp import web
+
+# Sample line in Prometheus text format: name, labels if any, value
+SAMPLE = re.compile(r'^([^\s{]+)(?:\{(.*)\})? (.*)$')
+
+
+class Process:
+    def __init__(self, script: str, number: int, shard_ids: list, metrics_port: int=None,
+                 args: list=()) -> None:
+        self.script = script
+        self.args = list(args)
+        self.number = number
+        self.shard_ids = shard_ids
+        self.metrics_port = metrics_port
+        self.proc = None
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def run(self) -> None:
+        # Keep the process running, waiting longer after each quick crash
+        env = dict(os.environ, SENKO_SHARD_IDS=','.join(map(str, self.shard_ids)))
+        if self.metrics_port:
+            env['SENKO_METRICS_PORT'] = str(self.metrics_port)
+        delay = 1
+        while True:
+            loop = asyncio.get_event_loop()
+            started = loop.time()
+            self.proc = await asyncio.create_subprocess_exec(sys.executable, '-u', self.script, *self.args, env=env)
+            code = await self.proc.wait()
+            print(f'Process {self.number} (shards {self.shard_ids}) exited with {code}', flush=True)
+            delay = 1 if loop.time() - started > 60 else min(delay * 2, 60)
+            self.restarts += 1
+            await asyncio.sleep(delay)
+
+    async def stop(self) -> None:
+        if self.running:
+            self.proc.terminate()
+            await self.proc.wait()
+
+
+def split(count: int, processes: int) -> list:
+    # Spread shards evenly, e.g. 5 shards over 2 processes is [0, 1, 2], [3, 4]
+    size, extra = divmod(count, processes)
+    groups, start = [], 0
+    for i in range(processes):
+        end = start + size + (i < extra)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def label(text: str, number: int) -> list:
+    # Add a process label to every sample in Prometheus text format
+    lines = []
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if line.startswith('#') or not match:
+            lines.append(line)
+            continue
+        name, labels, value = match.groups()
+        labels = f'{labels},process="{number}"' if labels else f'process="{number}"'
+        lines.append(f'{name}{{{labels}}} {value}')
+    return lines
+
+
+class Supervisor:
+    def __init__(self, processes: list) -> None:
+        self.processes = processes
+        self.session = None
+
+    async def _scrape(self, process: Process) -> str:
+        url = f'http://127.0.0.1:{process.metrics_port}/metrics'
+        async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    async def _scrape_all(self) -> list:
+        # Text of each process's metrics, or the error getting it
+        return await asyncio.gather(*(self._scrape(p) for p in self.processes), return_exceptions=True)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        # HELP and TYPE lines are the same for every process, keep the first
+        lines, seen = [], set()
+        for process, text in zip(self.processes, await self._scrape_all()):
+            if isinstance(text, Exception):
+                continue
+            for line in label(text, process.number):
+                if line.startswith('#'):
+                    if line in seen:
+                        continue
+                    seen.add(line)
+                lines.append(line)
+        up = [f'senko_process_up{{process="{p.number}"}} {int(p.running)}' for p in self.processes]
+        restarts = [f'senko_process_restarts_total{{process="{p.number}"}} {p.restarts}' for p in self.processes]
+        lines += ['# TYPE senko_process_up gauge', *up, '# TYPE senko_process_restarts_total counter', *restarts]
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8')
+
+    async def health(self, request: web.Request) -> web.Response:
+        status = {}
+        for process, text in zip(self.processes, await self._scrape_all()):
+            status[process.number] = {
+                'shards': process.shard_ids,
+                'running': process.running,
+                'answering': not isinstance(text, Exception),
+                'restarts': process.restarts,
+            }
+        healthy = all(s['running'] and s['answering'] for s in status.values())
+        return web.Response(text=json.dumps(status), status=200 if healthy else 503,
+                            content_type='application/json')
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        self.session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_get('/metrics', self.metrics)
+        app.router.add_get('/health', self.health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+async def main(script: str, args: list) -> None:
+    with open('config.yaml') as stream:
+        config = yaml.safe_load(stream)
+    shards = config.get('shards', {})
+    if not shards.get('count'):
+        sys.exit('Set shards.count in config.yaml to run sharded')
+
+    process_count = min(shards.get('processes', 1), shards['count'])
+    if process_count > 1 and not config.get('database', {}).get('journal', False):
+        sys.exit('Set database.journal in config.yaml to run more than one process')
+
+    metrics = config.get('metrics', {})
+    port = metrics.get('port')
+    groups = split(shards['count'], process_count)
+    processes = [Process(script, i, ids, port and port + 1 + i, args) for i, ids in enumerate(groups)]
+
+    runner = None
+    if port:
+        supervisor = Supervisor(processes)
+        runner = await supervisor.serve(metrics.get('host', '127.0.0.1'), port)
+
+    # docker stop sends SIGTERM, pass it on so the bots can shut down cleanly
+    running = asyncio.gather(*(p.run() for p in processes))
+    loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signal.SIGTERM, running.cancel)
+    loop.add_signal_handler(signal.SIGINT, running.cancel)
+    try:
+        await running
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await asyncio.gather(*(p.stop() for p in processes))
+        if runner is not None:
+            await supervisor.session.close()
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    script = sys.argv[1] if len(sys.argv) > 1 else 'senko.py'
+    asyncio.get_event_loop().run_until_complete(main(script, sys.argv[2:]))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import the bot's modules the same way the benchmarks do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
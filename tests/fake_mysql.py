@@ -0,0 +1,127 @@
+"""
+SQLite stand-in for the MySQL pool, for running the Database class against
+a real database without a MySQL server. Queries are translated just enough
+for the dialects to agree, and one connection can back several pools to
+act like processes sharing a database.
+"""
+import sqlite3
+
+# Raised like pymysql does, so add_words() falls back to one word at a time
+from pymysql.err import IntegrityError
+
+SCHEMA = """
+CREATE TABLE `keywords` (
+    `user` INTEGER NOT NULL,
+    `word` TEXT NOT NULL,
+    CONSTRAINT `unique_keyword` UNIQUE (`user`, `word`)
+);
+CREATE TABLE `guilds` (
+    `guild` INTEGER NOT NULL,
+    `user` INTEGER NOT NULL,
+    PRIMARY KEY (`guild`, `user`)
+);
+CREATE TABLE `journal` (
+    `version` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `created` TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    `origin` TEXT NOT NULL,
+    `action` TEXT NOT NULL,
+    `guild` INTEGER NULL,
+    `user` INTEGER NULL,
+    `word` TEXT NULL
+);
+"""
+
+# MySQL only statements and their SQLite equivalents
+REWRITES = [
+    ('CALL get_words (%s)', "SELECT g.`user`, k.`word` FROM `guilds` g "
+                            "JOIN `keywords` k ON k.`user` = g.`user` WHERE g.`guild` = %s"),
+    ('INSERT IGNORE', 'INSERT OR IGNORE'),
+    ('%s', '?'),
+]
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class Cursor:
+    """DictCursor-like wrapper around a SQLite cursor."""
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self.cursor = cursor
+
+    @staticmethod
+    def _translate(query: str) -> str:
+        for mysql, sqlite in REWRITES:
+            query = query.replace(mysql, sqlite)
+        return query
+
+    def execute(self, query: str, args: tuple=()) -> int:
+        try:
+            self.cursor.execute(self._translate(query), tuple(args))
+        except sqlite3.IntegrityError as err:
+            raise IntegrityError(f'unique_keyword: {err}')
+        return self.cursor.rowcount
+
+    def executemany(self, query: str, rows: list) -> int:
+        try:
+            self.cursor.executemany(self._translate(query), [tuple(r) for r in rows])
+        except sqlite3.IntegrityError as err:
+            raise IntegrityError(f'unique_keyword: {err}')
+        return self.cursor.rowcount
+
+    def _row(self, row: tuple) -> dict:
+        return {d[0]: value for d, value in zip(self.cursor.description, row)}
+
+    def fetchone(self) -> dict:
+        row = self.cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchall(self) -> list:
+        return [self._row(row) for row in self.cursor.fetchall()]
+
+
+class SQLitePool:
+    """Same interface as cogs.utils.pool.Pool, running on the event loop."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+    def run_now(self, func, *args, cursorclass=None):
+        try:
+            result = func(Cursor(self.conn.cursor()), *args)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return result
+
+    async def run(self, func, *args, cursorclass=None):
+        return self.run_now(func, *args)
+
+    async def fetchall(self, query: str, args: tuple=()) -> list:
+        def fetchall(cursor):
+            cursor.execute(query, args)
+            return cursor.fetchall()
+        return await self.run(fetchall)
+
+    async def fetchone(self, query: str, args: tuple=()) -> dict:
+        def fetchone(cursor):
+            cursor.execute(query, args)
+            return cursor.fetchone()
+        return await self.run(fetchone)
+
+    async def execute(self, query: str, args: tuple=()) -> int:
+        def execute(cursor):
+            return cursor.execute(query, args)
+        return await self.run(execute)
+
+    async def executemany(self, query: str, rows: list) -> int:
+        def executemany(cursor):
+            return cursor.executemany(query, rows)
+        return await self.run(executemany)
+
+    def close(self) -> None:
+        pass
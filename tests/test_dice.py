@@ -0,0 +1,99 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+
+from cogs.dice import EntropyPool, RandomAPI
+
+
+class StubAPI(RandomAPI):
+    """RandomAPI with random.org replaced by a seeded generator."""
+
+    def __init__(self, seed: int=0) -> None:
+        super().__init__('key')
+        self.rng = random.Random(seed)
+
+    async def _api_request(self, i: int, j: int, n: int) -> list:
+        return [self.rng.randint(i, j) for x in range(n)]
+
+
+def roll(api: RandomAPI, i: int, j: int, n: int=1) -> list:
+    async def run():
+        api.start()
+        return await api.roll(i, j, n)
+    return asyncio.run(run())
+
+
+def chi_square(counts: Counter, values: range) -> float:
+    expected = sum(counts.values()) / len(values)
+    return sum((counts[v] - expected) ** 2 / expected for v in values)
+
+
+def test_take_returns_bits_in_order():
+    pool = EntropyPool()
+    numbers = [0b10110, 0b00001, 0b11111, 0b01010]
+    pool.add(numbers, 5)
+    bits = ''.join(f'{n:05b}' for n in numbers)
+    widths = [3, 7, 1, 5, 4]
+    taken = [pool.take(w) for w in widths]
+    expected, start = [], 0
+    for w in widths:
+        expected.append(int(bits[start:start + w], 2))
+        start += w
+    assert taken == expected
+    assert pool.size == len(bits) - sum(widths)
+
+
+def test_take_more_than_left():
+    pool = EntropyPool()
+    pool.add([1], 29)
+    pool.take(20)
+    with pytest.raises(ValueError):
+        pool.take(10)
+    assert pool.take(9) == 1
+
+
+@pytest.mark.parametrize('sides, critical', [
+    # Chi-square critical values for p = 0.001
+    (6, 20.52),
+    (20, 43.82),
+])
+def test_uniform(sides, critical):
+    api = StubAPI()
+    counts = Counter(roll(api, 1, sides, 60000))
+    assert set(counts) == set(range(1, sides + 1))
+    assert chi_square(counts, range(1, sides + 1)) < critical
+
+
+def test_rejection_just_past_power_of_two():
+    # A span of 2**k + 1 needs k + 1 bits and rejects nearly half the draws
+    api = StubAPI()
+    counts = Counter(roll(api, 0, 16, 15000))
+    assert set(counts) == set(range(17))
+    assert chi_square(counts, range(17)) < 39.25
+    assert api.pool.taken > 15000 * 5 * 1.5
+
+
+def test_power_of_two_never_rejects():
+    api = StubAPI()
+    roll(api, 1, 8, 1000)
+    assert api.pool.taken == 3000
+
+
+def test_accounting_after_mixed_rolls():
+    api = StubAPI()
+
+    async def run():
+        api.start()
+        for i, j, n in [(1, 6, 1), (1, 20, 5), (10, 12345, 3), (1, 6, 33333),
+                        (5, 5, 4), (1, 2, 90000), (1, 1000000, 100)]:
+            result = await api.roll(i, j, n)
+            assert len(result) == n
+            assert all(min(i, j) <= x <= max(i, j) for x in result)
+    asyncio.run(run())
+
+    pool = api.pool
+    assert pool.added - pool.taken == pool.size
+    assert pool.size == sum(w for _, w in pool.chunks)
+    assert pool.added % api.width == 0
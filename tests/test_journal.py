@@ -0,0 +1,138 @@
+import asyncio
+
+from cogs.keywords import Database
+from fake_mysql import SQLitePool, connect
+
+CONFIG = {'socket': '', 'journal': True, 'cache_size': 10}
+
+
+def process(conn, **config) -> Database:
+    # A bot process with its own cache, sharing the database through conn
+    db = Database({**CONFIG, **config})
+    db.pool = db.writes.pool = SQLitePool(conn)
+    return db
+
+
+def seed(conn) -> None:
+    conn.executemany("INSERT INTO `keywords` VALUES (?, ?)",
+                     [(10, 'apple'), (20, 'pear'), (20, 'plum')])
+    conn.executemany("INSERT INTO `guilds` VALUES (?, ?)", [(1, 10), (2, 20)])
+    conn.commit()
+
+
+def journal(conn, version: int, action: str, guild=None, user=None, word=None) -> None:
+    # Write an entry as some other process would, with a chosen version
+    conn.execute("INSERT INTO `journal` (`version`, `origin`, `action`, `guild`, `user`, `word`) "
+                 "VALUES (?, 'other', ?, ?, ?, ?)", (version, action, guild, user, word))
+    conn.commit()
+
+
+def test_changes_reach_other_process():
+    async def run():
+        conn = connect()
+        seed(conn)
+        a, b = process(conn), process(conn)
+        await a.follow_journal()
+        await b.follow_journal()
+        assert dict((await b.get_guild(1)).users) == {10: {'apple'}}
+
+        await a.add_words(10, ['banana'])
+        await a.remove_words(10, ['apple'])
+        assert await b.follow_journal() == 2
+        assert dict((await b.get_guild(1)).users) == {10: {'banana'}}
+
+        # Membership changes are journalled when they're flushed
+        await a.add_guild_member(1, 20)
+        assert await b.follow_journal() == 0
+        await a.writes.flush()
+        assert await b.follow_journal() == 1
+        assert dict((await b.get_guild(1)).users) == {10: {'banana'}, 20: {'pear', 'plum'}}
+
+        await a.remove_user(20)
+        assert await b.follow_journal() == 1
+        assert dict((await b.get_guild(1)).users) == {10: {'banana'}}
+        assert await b.is_new_user(20)
+
+        # Nobody applies their own changes
+        assert await a.follow_journal() == 0
+        assert a.version == b.version
+    asyncio.run(run())
+
+
+def test_late_commit_is_not_skipped():
+    async def run():
+        conn = connect()
+        seed(conn)
+        b = process(conn)
+        await b.follow_journal()
+        await b.get_guild(1)
+
+        # Version 2 commits first, 1 is still in an open transaction
+        journal(conn, 2, 'add_word', user=10, word='cherry')
+        assert await b.follow_journal() == 1
+        assert set(b.gaps) == {1}
+
+        journal(conn, 1, 'add_word', user=10, word='grape')
+        assert await b.follow_journal() == 1
+        assert b.gaps == {}
+        assert (await b.get_guild(1)).users[10] == {'apple', 'cherry', 'grape'}
+
+        # Nothing is applied twice
+        assert await b.follow_journal() == 0
+    asyncio.run(run())
+
+
+def test_gaps_expire():
+    async def run():
+        conn = connect()
+        b = process(conn, journal_gap_timeout=0)
+        await b.follow_journal()
+        journal(conn, 5, 'remove_guild', guild=1)
+        assert await b.follow_journal() == 1
+        assert set(b.gaps) == {1, 2, 3, 4}
+
+        # A rolled back transaction never fills its gap
+        assert await b.follow_journal() == 0
+        assert b.gaps == {}
+    asyncio.run(run())
+
+
+def test_pruned_entries_clear_cache():
+    async def run():
+        conn = connect()
+        seed(conn)
+        b = process(conn, journal_retention=0)
+        await b.follow_journal()
+        await b.get_guild(1)
+
+        # Entries 1 and 2 got pruned before we read them
+        journal(conn, 3, 'add_word', user=20, word='fig')
+        await b.follow_journal()
+        assert b.cache.peek(1) is None
+    asyncio.run(run())
+
+
+def test_new_user_gets_guilds_of_other_shards():
+    async def run():
+        conn = connect()
+        seed(conn)
+        a, b = process(conn), process(conn)
+        await a.follow_journal()
+        await b.follow_journal()
+
+        # b's shards have guild 2, where user 30 is a member
+        async def on_new_user(user):
+            await b.add_user_guilds([2], user)
+        b.on_new_user = on_new_user
+
+        # User 30 adds keywords in a's guild 1
+        await a.add_new_user([1], 30)
+        await a.add_words(30, ['kiwi'])
+        await b.follow_journal()
+        assert not await b.is_new_user(30)
+        assert (await b.get_guild(2)).users[30] == {'kiwi'}
+
+        await b.writes.flush()
+        rows = conn.execute("SELECT `guild` FROM `guilds` WHERE `user` = 30 ORDER BY `guild`")
+        assert [guild for guild, in rows] == [1, 2]
+    asyncio.run(run())
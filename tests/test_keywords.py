@@ -0,0 +1,131 @@
+import asyncio
+from types import SimpleNamespace
+
+from cogs.keywords import Database
+from fake_mysql import SQLitePool, connect
+
+
+class GatedPool(SQLitePool):
+    """Reads guilds right away but only returns them once the gate opens."""
+
+    def __init__(self, conn) -> None:
+        super().__init__(conn)
+        self.gate = asyncio.Event()
+        self.reads = 0
+
+    async def fetchall(self, query: str, args: tuple=()) -> list:
+        results = await super().fetchall(query, args)
+        if query.startswith('CALL get_words'):
+            self.reads += 1
+            await self.gate.wait()
+        return results
+
+
+def make_database() -> Database:
+    conn = connect()
+    conn.executemany("INSERT INTO `keywords` VALUES (?, ?)", [(10, 'apple'), (20, 'pear')])
+    conn.executemany("INSERT INTO `guilds` VALUES (?, ?)", [(1, 10), (2, 20)])
+    conn.commit()
+    db = Database({'socket': ''})
+    db.pool = db.writes.pool = GatedPool(conn)
+    return db
+
+
+async def load_during(db: Database, write) -> dict:
+    # Start loading guild 1, commit write while the read is in flight
+    loading = asyncio.ensure_future(db.get_guild(1))
+    while not db.pool.reads:
+        await asyncio.sleep(0)
+    await write()
+    db.pool.gate.set()
+    return dict((await loading).users)
+
+
+def test_words_added_while_loading():
+    async def run():
+        db = make_database()
+        users = await load_during(db, lambda: db.add_words(10, ['banana']))
+        assert users == {10: {'apple', 'banana'}}
+        assert db.pool.reads == 2
+    asyncio.run(run())
+
+
+def test_new_user_added_while_loading():
+    async def run():
+        db = make_database()
+        # What !notify add does for someone new
+        async def notify_add():
+            await db.add_new_user([1], 30)
+            await db.add_words(30, ['kiwi'])
+        users = await load_during(db, notify_add)
+        assert users == {10: {'apple'}, 30: {'kiwi'}}
+    asyncio.run(run())
+
+
+def test_loads_share_one_read():
+    async def run():
+        db = make_database()
+        db.pool.gate.set()
+        views = await asyncio.gather(*(db.get_guild(1) for _ in range(5)))
+        assert all(view is views[0] for view in views)
+        assert db.pool.reads == 1
+    asyncio.run(run())
+
+
+def test_joining_guild_with_leftover_mappings():
+    async def run():
+        db = make_database()
+        db.pool.gate.set()
+        db.pool.conn.execute("INSERT INTO `guilds` VALUES (3, 10)")
+        members = [SimpleNamespace(id=user) for user in (10, 20, 40)]
+        await db.add_guild(SimpleNamespace(id=3, members=members))
+        rows = db.pool.conn.execute("SELECT `user` FROM `guilds` WHERE `guild` = 3 ORDER BY `user`")
+        assert [user for user, in rows] == [10, 20]
+    asyncio.run(run())
+
+
+async def start_flush(db: Database) -> tuple:
+    # Flush the pending writes, holding them back until the returned
+    # event is set
+    started, release = asyncio.Event(), asyncio.Event()
+    run = db.pool.run
+
+    async def held(func, *args, **kwargs):
+        started.set()
+        await release.wait()
+        return await run(func, *args, **kwargs)
+
+    db.writes.pool = SimpleNamespace(run=held)
+    flushing = asyncio.ensure_future(db.writes.flush())
+    await started.wait()
+    return flushing, release
+
+
+def test_guild_loaded_while_flushing():
+    async def run():
+        db = make_database()
+        db.pool.gate.set()
+        await db.load_known_users()
+        await db.add_guild_member(1, 20)
+        flushing, release = await start_flush(db)
+        assert dict((await db.get_guild(1)).users) == {10: {'apple'}, 20: {'pear'}}
+        release.set()
+        await flushing
+    asyncio.run(run())
+
+
+def test_flush_committed_while_loading():
+    async def run():
+        db = make_database()
+        await db.load_known_users()
+        await db.add_guild_member(1, 20)
+        flushing, release = await start_flush(db)
+        # The read misses the batch, which is gone from the buffer by the
+        # time it returns
+        async def commit():
+            release.set()
+            await flushing
+        users = await load_during(db, commit)
+        assert users == {10: {'apple'}, 20: {'pear'}}
+        assert db.pool.reads == 2
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from cogs.utils.logs import JsonFormatter, RecordHandler, TextFormatter
+
+
+class Collect(logging.Handler):
+    def __init__(self, formatter: logging.Formatter) -> None:
+        super().__init__()
+        self.setFormatter(formatter)
+        self.lines = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(self.format(record))
+
+
+def through_queue(*handlers: logging.Handler) -> None:
+    records = queue.Queue()
+    logger = logging.getLogger('test_logs')
+    logger.propagate = False
+    handler = RecordHandler(records)
+    logger.addHandler(handler)
+    listener = QueueListener(records, *handlers)
+    listener.start()
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('dividing %s', 'things', extra={'user': 7})
+    finally:
+        listener.stop()
+        logger.removeHandler(handler)
+
+
+def test_json_exception():
+    out = Collect(JsonFormatter())
+    through_queue(out)
+    entry = json.loads(out.lines[0])
+    assert entry['message'] == 'dividing things'
+    assert entry['user'] == 7
+    assert 'ZeroDivisionError' in entry['exception']
+
+
+def test_text_exception():
+    out = Collect(TextFormatter('%(message)s'))
+    through_queue(out)
+    line, = out.lines
+    assert line.startswith('dividing things\nTraceback')
+    assert line.count('ZeroDivisionError') == 1
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from cogs.utils.notify import Coalescer, Dispatcher
+
+
+def make(**kwargs) -> tuple:
+    sent = []
+
+    async def send(route, number):
+        sent.append((route, number, time.monotonic()))
+    dispatcher = Dispatcher(send, **kwargs)
+    dispatcher.start(asyncio.get_event_loop())
+    return dispatcher, sent
+
+
+def test_busy_route_does_not_block_others():
+    async def run():
+        dispatcher, sent = make(workers=2, route_rate=10)
+        start = time.monotonic()
+        for number in range(8):
+            await dispatcher.put('busy', 'busy', number)
+        await dispatcher.put('other', 'other', 0)
+        await asyncio.sleep(0.05)
+        assert ('other', 0) in [(r, n) for r, n, t in sent]
+        assert sent[-1][2] - start < 0.05
+
+        await dispatcher.join()
+        busy = [t for r, n, t in sent if r == 'busy']
+        assert [n for r, n, t in sent if r == 'busy'] == list(range(8))
+        assert all(b - a >= 0.09 for a, b in zip(busy, busy[1:]))
+        assert dispatcher.stats()['queued'] == 0
+        dispatcher.stop()
+    asyncio.run(run())
+
+
+def test_put_waits_when_full():
+    async def run():
+        gate = asyncio.Event()
+
+        async def send(number):
+            await gate.wait()
+        dispatcher = Dispatcher(send, workers=1, queue_size=2)
+        dispatcher.start(asyncio.get_event_loop())
+        for number in range(2):
+            await dispatcher.put(number, number)
+        third = asyncio.ensure_future(dispatcher.put(2, 2))
+        await asyncio.sleep(0.02)
+        assert not third.done()
+        assert dispatcher.stats()['queued'] == 2
+
+        gate.set()
+        await asyncio.wait_for(third, 1)
+        await dispatcher.join()
+        assert dispatcher.stats()['sent'] == 3
+        dispatcher.stop()
+    asyncio.run(run())
+
+
+def test_failed_send_is_counted():
+    async def run():
+        async def send():
+            raise RuntimeError('cannot DM')
+        dispatcher = Dispatcher(send)
+        dispatcher.start(asyncio.get_event_loop())
+        await dispatcher.put('route')
+        await dispatcher.join()
+        assert dispatcher.stats()['failed'] == 1
+        dispatcher.stop()
+    asyncio.run(run())
+
+
+def test_coalescer():
+    coalescer = Coalescer(window=1, cooldown=60)
+    assert coalescer.allow(1, 'apple')
+    assert not coalescer.allow(1, 'apple')
+    assert coalescer.allow(2, 'apple')
+    assert coalescer.add((1, 10), 'a')
+    assert not coalescer.add((1, 10), 'b')
+    assert coalescer.pop((1, 10)) == ['a', 'b']
+    assert coalescer.pop((1, 10)) == []
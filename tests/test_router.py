@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+from cogs.utils.router import Router
+
+
+def make_bot() -> SimpleNamespace:
+    return SimpleNamespace(user=SimpleNamespace(id=1), dt=frozenset({30}),
+                           quiet={'guilds': frozenset(), 'channels': frozenset({20})})
+
+
+def make_message(channel: int=10, guild: int=100, author: int=2) -> SimpleNamespace:
+    return SimpleNamespace(guild=guild and SimpleNamespace(id=guild), content='hello', embeds=[],
+                           author=SimpleNamespace(id=author, bot=False),
+                           channel=SimpleNamespace(id=channel))
+
+
+def test_handlers_run_by_priority_then_name():
+    router = Router(make_bot())
+    calls = []
+
+    def handler(name):
+        async def handle(envelope):
+            calls.append(name)
+        return handle
+
+    # Registered in the order cogs might happen to load
+    router.add('keywords', handler('keywords'), priority=1)
+    router.add('okaeri', handler('okaeri'))
+    router.add('dt', handler('dt'))
+    asyncio.run(router.dispatch(make_message()))
+    assert calls == ['dt', 'okaeri', 'keywords']
+
+    router.remove('okaeri')
+    calls.clear()
+    asyncio.run(router.dispatch(make_message()))
+    assert calls == ['dt', 'keywords']
+
+
+def test_slow_handler_does_not_delay_replies():
+    router = Router(make_bot())
+    replied = []
+
+    async def keywords(envelope):
+        # Waiting on a guild to load
+        await asyncio.sleep(0.2)
+
+    async def okaeri(envelope):
+        replied.append(asyncio.get_event_loop().time())
+
+    router.add('keywords', keywords, priority=1)
+    router.add('okaeri', okaeri)
+
+    async def run():
+        start = asyncio.get_event_loop().time()
+        await router.dispatch(make_message())
+        return replied[0] - start
+    assert asyncio.run(run()) < 0.1
+
+
+def test_filters_and_failures():
+    router = Router(make_bot())
+    seen = []
+
+    async def broken(envelope):
+        raise RuntimeError('broken handler')
+
+    async def record(envelope):
+        seen.append((envelope.message.channel.id, envelope.dm, envelope.quiet, envelope.dt))
+
+    router.add('broken', broken)
+    router.add('record', record, lambda m: not m.own and not m.quiet)
+    for message in (make_message(), make_message(channel=20), make_message(channel=30),
+                    make_message(guild=None), make_message(author=1)):
+        asyncio.run(router.dispatch(message))
+    assert seen == [(10, False, False, False), (30, False, False, True), (10, True, False, False)]
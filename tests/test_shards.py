@@ -0,0 +1,39 @@
+import pytest
+
+from cogs.utils import shards
+
+CONFIG = {
+    'shards': {'count': 4},
+    'metrics': {'port': 9100},
+    'database': {'snapshot': 'data/keywords.snapshot', 'journal': True},
+}
+
+
+def test_not_sharded():
+    sharding = shards.settings({'database': {}}, {})
+    assert sharding == {'count': None, 'ids': None, 'metrics': {}, 'db': {}}
+
+
+def test_all_shards_in_one_process():
+    config = dict(CONFIG, database={'snapshot': 'keywords.snapshot'})
+    sharding = shards.settings(config, {})
+    assert sharding['count'] == 4
+    assert sharding['ids'] is None
+    assert sharding['db']['snapshot'] == 'keywords.snapshot'
+
+
+def test_process_of_supervisor():
+    environ = {'SENKO_SHARD_IDS': '2,3', 'SENKO_METRICS_PORT': '9103'}
+    sharding = shards.settings(CONFIG, environ)
+    assert sharding['ids'] == [2, 3]
+    assert sharding['metrics'] == {'port': 9103}
+    assert sharding['db']['snapshot'] == 'data/keywords.snapshot.2-3'
+    # The config itself is left alone
+    assert CONFIG['database']['snapshot'] == 'data/keywords.snapshot'
+
+
+def test_some_shards_need_journal():
+    config = dict(CONFIG, database={})
+    with pytest.raises(ValueError):
+        shards.settings(config, {'SENKO_SHARD_IDS': '0,1'})
+    assert shards.settings(config, {'SENKO_SHARD_IDS': '0,1,2,3'})['ids'] == [0, 1, 2, 3]
@@ -0,0 +1,101 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+SUPERVISOR = os.path.join(ROOT, 'supervisor.py')
+FAKE_SHARD = os.path.join(ROOT, 'benchmarks', 'fake_shard.py')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(url: str) -> tuple:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as err:
+        return err.code, err.read().decode()
+    except OSError:
+        return None, ''
+
+
+def wait_for(check, timeout: float=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(0.2)
+    raise AssertionError('Timed out')
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    # Start supervisor.py with fake shards, 3 shards over 2 processes
+    procs = []
+
+    def start(*args, journal='true'):
+        port = free_port()
+        (tmp_path / 'config.yaml').write_text(
+            f'shards:\n  count: 3\n  processes: 2\nmetrics:\n  port: {port}\n'
+            f'database:\n  journal: {journal}\n')
+        proc = subprocess.Popen([sys.executable, SUPERVISOR, FAKE_SHARD, '--guilds', '7', *args],
+                                cwd=tmp_path, stdout=subprocess.DEVNULL)
+        procs.append(proc)
+        return proc, f'http://127.0.0.1:{port}'
+
+    yield start
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def test_health_and_metrics(supervisor):
+    proc, url = supervisor()
+    status, body = wait_for(lambda: (lambda r: r[0] == 200 and r)(get(f'{url}/health')))
+    assert json.loads(body) == {
+        '0': {'shards': [0, 1], 'running': True, 'answering': True, 'restarts': 0},
+        '1': {'shards': [2], 'running': True, 'answering': True, 'restarts': 0},
+    }
+
+    status, body = get(f'{url}/metrics')
+    assert status == 200
+    lines = body.splitlines()
+    for shard, process in ((0, 0), (1, 0), (2, 1)):
+        assert f'senko_guilds{{shard="{shard}",process="{process}"}} 7' in lines
+    assert lines.count('# TYPE senko_guilds gauge') == 1
+    assert 'senko_process_up{process="1"} 1' in lines
+
+    # SIGTERM stops the children and the supervisor cleanly
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait(timeout=10) == 0
+    assert get(f'{url}/health')[0] is None
+
+
+def test_crashed_process_is_restarted(supervisor):
+    proc, url = supervisor('--crash-after', '1')
+    wait_for(lambda: 'senko_process_restarts_total{process="0"} 1' in get(f'{url}/metrics')[1])
+
+    # Between a crash and the restart, health reports the process down
+    def unhealthy():
+        status, body = get(f'{url}/health')
+        return status == 503 and not json.loads(body)['0']['running']
+    wait_for(unhealthy)
+
+
+def test_several_processes_need_journal(supervisor):
+    proc, url = supervisor(journal='false')
+    assert proc.wait(timeout=10) != 0
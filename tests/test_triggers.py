@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from cogs.utils import triggers
+from cogs.utils.triggers import Trigger, Triggers
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def table(*patterns) -> Triggers:
+    return Triggers([Trigger(p, reply=str(i)) for i, p in enumerate(patterns)])
+
+
+def reply(table: Triggers, text: str) -> str:
+    trigger = table.match(text)
+    return trigger and trigger.reply
+
+
+def test_defaults(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    tables = triggers.load()
+    assert reply(tables['okaeri'], "i'm back!") == 'おかえりなのじゃ！'
+    assert reply(tables['okaeri'], 'goodnight all') == 'おやすみなのじゃ！'
+    assert tables['dt'].match('oh boi').filename == 'boi.jpg'
+    assert tables['dt'].match('boiling') is None
+
+
+def test_first_in_table_wins():
+    triggers = table(r'\bhello\b', r'\bhello there\b')
+    assert reply(triggers, 'hello there') == '0'
+    assert reply(triggers, 'nothing here') is None
+
+
+def test_numbered_backreference():
+    # Combined, \1 would point at the first trigger's group
+    triggers = table(r'(a)x', r'(b)\1')
+    assert reply(triggers, 'bb') == '1'
+    assert reply(triggers, 'ax') == '0'
+    assert reply(triggers, 'b') is None
+
+
+def test_inline_flags():
+    # (?s) mustn't let dots match newlines in the other triggers either
+    triggers = table(r'x.y', r'(?s)a.b')
+    assert reply(triggers, 'a\nb') == '1'
+    assert reply(triggers, 'x\ny') is None
+    assert reply(triggers, 'xzy') == '0'
+
+
+def test_uppercase_pattern():
+    # Messages are casefolded before matching, patterns mustn't care
+    triggers = table(r"\bI'm back\b", r'(b)\1', r'\WGN$')
+    assert reply(triggers, "i'm back") == '0'
+    assert reply(triggers, 'bb') == '1'
+    assert reply(triggers, 'night gn') == '2'
+
+
+def test_reload_bad_yaml(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text('triggers: [\n')
+    with pytest.raises(ValueError):
+        triggers.reload(str(path))
+    path.write_text('')
+    with pytest.raises(ValueError):
+        triggers.reload(str(path))
+
+
+def test_order_kept_between_combined_and_separate():
+    assert reply(table(r'(b)\1', r'x'), 'bb x') == '0'
+    assert reply(table(r'x', r'(b)\1'), 'bb x') == '0'
+    assert reply(table(r'x', r'(b)\1'), 'bb') == '1'
+
+
+def test_same_group_names():
+    triggers = table(r'(?P<word>cat)s', r'(?P<word>dog)s')
+    assert reply(triggers, 'dogs') == '1'
+    assert reply(triggers, 'cats') == '0'
+
+
+def test_bad_trigger():
+    with pytest.raises(ValueError):
+        triggers.load({'okaeri': [{'pattern': '('}]})
+    with pytest.raises(ValueError):
+        triggers.load({'okaeri': [{'pattern': 'a(?i)b', 'reply': 'x'}]})
+    with pytest.raises(ValueError):
+        triggers.load({'okaeri': [{'pattern': 'hi'}]})
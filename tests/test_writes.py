@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from cogs.keywords import Database
+from cogs.utils.writes import WriteBehind
+from fake_mysql import SQLitePool, connect
+
+
+class FakePool:
+    """Records what gets written, failing while down is set."""
+
+    def __init__(self) -> None:
+        self.written = []
+        self.blocking = 0
+        self.down = False
+
+    def _run(self, func, *args):
+        if self.down:
+            raise ConnectionError('database down')
+        return func(None, *args)
+
+    async def run(self, func, *args, cursorclass=None):
+        return self._run(func, *args)
+
+    def run_now(self, func, *args):
+        self.blocking += 1
+        return self._run(func, *args)
+
+
+def make(**kwargs) -> tuple:
+    pool = FakePool()
+    writes = WriteBehind(pool, lambda cursor, changes: pool.written.append(changes), **kwargs)
+    return pool, writes
+
+
+def test_join_and_leave_coalesce():
+    async def run():
+        pool, writes = make()
+        writes.put(('member', 1, 10), True)
+        writes.put(('member', 1, 20), True)
+        writes.put(('member', 1, 10), False)
+        await writes.flush()
+        assert pool.written == [[(('member', 1, 20), True), (('member', 1, 10), False)]]
+        assert writes.stats()['coalesced'] == 1
+        assert writes.stats()['pending'] == 0
+
+        # Nothing to write, nothing written
+        await writes.flush()
+        assert len(pool.written) == 1
+    asyncio.run(run())
+
+
+def test_discard():
+    pool, writes = make()
+    writes.put(('member', 1, 10), True)
+    writes.put(('member', 2, 10), True)
+    writes.discard(lambda key: key[1] == 1)
+    assert writes.find(lambda key: True) == [(('member', 2, 10), True)]
+
+
+def test_flushes_when_full():
+    async def run():
+        pool, writes = make(max_pending=3, interval=60)
+        writes.start(asyncio.get_event_loop())
+        for user in range(2):
+            writes.put(('member', 1, user), True)
+        await asyncio.sleep(0.05)
+        assert pool.written == []
+        writes.put(('member', 1, 2), True)
+        await asyncio.sleep(0.05)
+        assert [len(changes) for changes in pool.written] == [3]
+        writes.task.cancel()
+    asyncio.run(run())
+
+
+def test_flushes_after_interval():
+    async def run():
+        pool, writes = make(max_pending=100, interval=0.1)
+        writes.start(asyncio.get_event_loop())
+        writes.put(('member', 1, 10), True)
+        await asyncio.sleep(0.05)
+        assert pool.written == []
+        assert 0 < writes.lag() < 0.1
+        await asyncio.sleep(0.1)
+        assert pool.written == [[(('member', 1, 10), True)]]
+        assert writes.lag() == 0
+        writes.task.cancel()
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_changes():
+    async def run():
+        pool, writes = make()
+        writes.put(('member', 1, 10), True)
+        writes.put(('member', 1, 20), True)
+        pool.down = True
+        with pytest.raises(ConnectionError):
+            await writes.flush()
+
+        # Changed again while the database was down, the newer change wins
+        writes.put(('member', 1, 20), False)
+        writes.put(('member', 1, 30), True)
+        pool.down = False
+        await writes.flush()
+        assert pool.written == [[(('member', 1, 10), True), (('member', 1, 20), False),
+                                 (('member', 1, 30), True)]]
+    asyncio.run(run())
+
+
+def test_stop_writes_everything_left():
+    async def run():
+        pool, writes = make(interval=60)
+        writes.start(asyncio.get_event_loop())
+        writes.put(('member', 1, 10), True)
+        writes.stop()
+        assert pool.blocking == 1
+        assert pool.written == [[(('member', 1, 10), True)]]
+        assert writes.stats()['pending'] == 0
+    asyncio.run(run())
+
+
+def test_guild_loaded_before_flush_has_pending_members():
+    async def run():
+        conn = connect()
+        conn.executemany("INSERT INTO `keywords` VALUES (?, ?)", [(10, 'apple'), (20, 'pear'), (30, 'fig')])
+        conn.executemany("INSERT INTO `guilds` VALUES (?, ?)", [(1, 10), (1, 30), (2, 20)])
+        conn.commit()
+        db = Database({'socket': '', 'flush_interval': 60})
+        db.pool = db.writes.pool = SQLitePool(conn)
+        await db.load_known_users()
+
+        # Guild 1 isn't cached, so only the pending writes know about these
+        await db.add_guild_member(1, 20)
+        await db.remove_guild_member(1, 30)
+        assert dict((await db.get_guild(1)).users) == {10: {'apple'}, 20: {'pear'}}
+
+        await db.writes.flush()
+        db.cache.clear()
+        assert dict((await db.get_guild(1)).users) == {10: {'apple'}, 20: {'pear'}}
+    asyncio.run(run())